@@ -1,6 +1,10 @@
 from sokoban import Map
 from search_methods.ida_star import IDAStarSolver
-from search_methods.simulated_annealing import SimulatedAnnealingSolver
+from search_methods.parallel_ida_star import ParallelIDAStarSolver, DEFAULT_SPLIT_DEPTH
+from search_methods.a_star import AStarSolver
+from search_methods.bidirectional import BidirectionalSolver
+from search_methods.simulated_annealing import SimulatedAnnealingSolver, ADAPTIVE_WINDOW, DEFAULT_PATIENCE, DEFAULT_TABU_TENURE
+from search_methods.parallel_annealing import ParallelAnnealingSolver
 from search_methods.heuristics import (
     simulated_annealing_heuristic,
     hungarian_assignment,
@@ -10,8 +14,15 @@ from search_methods.heuristics import (
     is_tunnel_deadlock,
     is_edge_deadlock,
     is_2x2_deadlock,
-    manhattan_greedy_safe
+    is_static_deadlock,
+    is_freeze_deadlock,
+    manhattan_greedy_safe,
+    pattern_database_heuristic,
+    DEFAULT_CACHE_ENTRIES
 )
+from search_methods.transposition import DEFAULT_TABLE_ENTRIES
+from search_methods.optimizer import SolutionOptimizer, DEFAULT_WINDOW
+from search_methods.pattern_database import PatternDatabase, build as build_pattern_database, pattern_size_for
 from plot_helpers import plot_states_for_map_algorithm, plot_runtime_evolution, plot_pulls_for_map_algorithm
 import argparse
 import os
@@ -27,6 +38,7 @@ HEURISTICS = {
     'hungarian': hungarian_assignment,
     'ida_star': ida_star_heuristic,
     'exact_matching': exact_matching_cost,
+    'pattern_database': pattern_database_heuristic,
 }
 
 DEADLOCKS = {
@@ -34,6 +46,8 @@ DEADLOCKS = {
     'tunnel': is_tunnel_deadlock,
     'edge': is_edge_deadlock,
     '2x2': is_2x2_deadlock,
+    'static': is_static_deadlock,
+    'freeze': is_freeze_deadlock,
 }
 
 def create_output_directories(base_dir, algorithm, test_name):
@@ -66,7 +80,7 @@ def main():
     ############################# Argument for algorithm selection ##############################
     parser.add_argument(
         '-a', '--algorithm',
-        choices=['ida_star', 'simulated_annealing'],
+        choices=['ida_star', 'astar', 'bidirectional', 'simulated_annealing'],
         default='ida_star',
         help='Algorithm to use for solving the Sokoban puzzle'
     )
@@ -114,6 +128,20 @@ def main():
         help='Enable edge deadlock detection'
     )
 
+    ########################### Argument for choosing freeze deadlock ###########################
+    parser.add_argument(
+        '--freeze',
+        action='store_true',
+        help='Enable freeze deadlock detection (boxes pinned against walls and each other)'
+    )
+
+    ########################### Argument for choosing static deadlock ###########################
+    parser.add_argument(
+        '--static',
+        action='store_true',
+        help='Enable dead square detection (cells a box can never be pushed to a target from)'
+    )
+
     ############################### Argument for GIF file saving ################################
     parser.add_argument(
         '--save-gif', 
@@ -128,6 +156,168 @@ def main():
         help='Disable visual output during solving'
     )
 
+    ############################ Argument for push-level search ################################
+    parser.add_argument(
+        '--push-level',
+        action='store_true',
+        help='Branch only on box moves from the player\'s reachable region, walks are filled in afterwards'
+    )
+
+    ############################ Argument for the heuristic cache #############################
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=DEFAULT_CACHE_ENTRIES,
+        help='Maximum number of box configurations kept in the heuristic cache (0 disables it)'
+    )
+
+    ########################## Argument for the learned deadlock database #######################
+    parser.add_argument(
+        '--deadlock-db',
+        default=None,
+        metavar='PATH',
+        help='JSON file of dead box patterns learned by IDA*, loaded at startup and extended after each solve'
+    )
+
+    ########################## Argument for the pattern database heuristic ####################
+    parser.add_argument(
+        '--build-pdb',
+        action='store_true',
+        help='Build the missing pattern database of the level before the solve starts, outside its time'
+    )
+
+    ########################## Argument for the IDA* transposition table #######################
+    parser.add_argument(
+        '--tt-size',
+        type=int,
+        default=DEFAULT_TABLE_ENTRIES,
+        help='Number of entries of the IDA* transposition table, rounded down to a power of two (32 bytes each)'
+    )
+
+    ############################# Argument for the IDA* depth limit ############################
+    parser.add_argument(
+        '--max-depth',
+        type=int,
+        default=None,
+        help='Deepest path IDA* explores, in moves (box moves at push level); unlimited by default'
+    )
+
+    ################################ Argument for weighted A* #################################
+    parser.add_argument(
+        '--weight',
+        type=float,
+        default=1.0,
+        help='Weight of the heuristic in A* (f = g + weight * h); 1 keeps solutions optimal'
+    )
+
+    ############################## Arguments for parallel IDA* ################################
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes IDA* searches with (1 runs the sequential search)'
+    )
+
+    parser.add_argument(
+        '--split-depth',
+        type=int,
+        default=DEFAULT_SPLIT_DEPTH,
+        help='Depth the root is expanded to before its subtrees are handed to the workers'
+    )
+
+    ########################## Arguments for parallel simulated annealing ######################
+    parser.add_argument(
+        '--chains',
+        type=int,
+        default=1,
+        help='Number of independent simulated annealing chains run over a process pool'
+    )
+
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Seed of simulated annealing; with several chains, the seed every chain seed is spawned from'
+    )
+
+    parser.add_argument(
+        '--sa-temps',
+        type=float,
+        nargs='+',
+        default=[1000],
+        help='Initial temperatures the chains cycle through'
+    )
+
+    parser.add_argument(
+        '--sa-alphas',
+        type=float,
+        nargs='+',
+        default=[0.01],
+        help='Alpha values (acceptance scale) the chains cycle through'
+    )
+
+    parser.add_argument(
+        '--adaptive-cooling',
+        action='store_true',
+        help='Reheat a frozen annealing chain, restart a stagnating one from its best state, and stop it early'
+    )
+
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=ADAPTIVE_WINDOW,
+        help='Steps per window of the adaptive cooling schedule'
+    )
+
+    parser.add_argument(
+        '--patience',
+        type=int,
+        default=DEFAULT_PATIENCE,
+        help='Steps without a better heuristic after which an adaptive annealing chain stops'
+    )
+
+    parser.add_argument(
+        '--tabu-tenure',
+        type=int,
+        default=DEFAULT_TABU_TENURE,
+        help='Steps a state visited by simulated annealing stays forbidden for, 0 disables the tabu memory'
+    )
+
+    ########################## Arguments for anytime solving ###################################
+    parser.add_argument(
+        '--time-limit',
+        type=float,
+        default=None,
+        help='Seconds a solve may run for; when they run out, the best partial path found is reported'
+    )
+
+    parser.add_argument(
+        '--node-limit',
+        type=int,
+        default=None,
+        help='Nodes a solve may expand; when they run out, the best partial path found is reported'
+    )
+
+    ########################## Arguments for the solution optimizer ###########################
+    parser.add_argument(
+        '--optimize-solution',
+        action='store_true',
+        help='Shorten the solution of any algorithm by replacing its segments with shortest paths'
+    )
+
+    parser.add_argument(
+        '--optimize-window',
+        type=int,
+        default=DEFAULT_WINDOW,
+        help='Moves a replacement path of the solution optimizer may take at most'
+    )
+
+    parser.add_argument(
+        '--minimize-pulls',
+        action='store_true',
+        help='Make the solution optimizer remove pulls first and moves second'
+    )
+
     parser.add_argument(
         '--benchmark',
         action='store_true',
@@ -157,6 +347,10 @@ def main():
             active_deadlocks.append('2x2')
         if args.edge:
             active_deadlocks.append('edge')
+        if args.freeze:
+            active_deadlocks.append('freeze')
+        if args.static:
+            active_deadlocks.append('static')
 
     all_results = {}
 
@@ -185,27 +379,47 @@ def main():
 
                     # map_from_yaml = Map.from_yaml('./tests/easy_map1.yaml')
 
+                    # options only IDA* understands
+                    solver_options = {}
+                    if alg_name == 'IDA*':
+                        solver_options['deadlock_db'] = args.deadlock_db
+                        solver_options['tt_size'] = args.tt_size
+                        solver_options['max_depth'] = args.max_depth
+
                     start = time.perf_counter()
                     solver = SolverClass(
                         map_from_yaml,
                         heuristic=heu_func,
                         deadlocks=active_deadlocks,
+                        push_level=args.push_level,
+                        cache_size=args.cache_size,
+                        deadline=args.time_limit,
+                        max_nodes=args.node_limit,
+                        **solver_options,
                     )
                     solution = solver.solve()
+                    if solution and args.optimize_solution:
+                        optimizer = SolutionOptimizer(map_from_yaml, window=args.optimize_window,
+                                                      push_aware=args.minimize_pulls)
+                        solution = optimizer.optimize(solution)
                     elapsed = time.perf_counter() - start
                     minutes, seconds = divmod(elapsed, 60)
 
                     final_map = map_from_yaml.copy()
-                    for move in solution:
+                    for move in solution or []:
                         final_map.apply_move(move)
                     pull_moves = final_map.undo_moves
 
                     print(f"\nTest: {test_name}")
                     print(f"Algorithm: {alg_name.upper()}")
                     print(f"Heuristic: {heu_name}")
-                    print(f"Solution found in {len(solution)} moves!")
+                    if solution:
+                        print(f"Solution found in {len(solution)} moves!")
+                    else:
+                        print(f"No solution ({solver.result.status})")
                     print(f"States expanded: {solver.nodes_expanded}")
                     print(f"Pull moves: {pull_moves}")
+                    print(f"Heuristic cache: {solver.cache_hits} hits, {solver.cache_misses} misses")
                     print(f"Time elapsed: {int(minutes)}m {int(seconds)}s")
 
                     # replay solution to count pulls
@@ -247,6 +461,14 @@ def main():
         return
     
     # MANUAL MODE
+    test_file = files_to_run[0]
+    test_name = os.path.splitext(os.path.basename(test_file))[0]
+    try:
+        map_from_yaml = Map.from_yaml(test_file)
+    except Exception as e:
+        print(f"Error loading map file: {e}")
+        sys.exit(1)
+
     base_dir = 'images'
     frames_dir, gif_dir = create_output_directories(base_dir, args.algorithm, test_name)
 
@@ -256,43 +478,182 @@ def main():
 
     heuristic_chosen = HEURISTICS[args.heuristic]
 
+    # The pattern database is precomputed offline, never inside the solve and its deadline
+    if args.heuristic == 'pattern_database':
+        board = map_from_yaml.board
+        size = pattern_size_for(board)
+        path = PatternDatabase.path_for(board, size)
+        if not os.path.exists(path):
+            if not args.build_pdb:
+                print(f"No pattern database at {path}. Build it with "
+                      f"'python -m search_methods.pattern_database {test_file} --size {size}', or pass --build-pdb")
+                sys.exit(1)
+            print(f"Pattern database written to {build_pattern_database(board, size)}")
+
     # Run the selected algorithm
     start = time.perf_counter()
+    # Budget of the solve, the same for every algorithm
+    budget = {'deadline': args.time_limit, 'max_nodes': args.node_limit}
+    # Counted on the replay of the solution, none without one
+    pull_moves = 0
     
     if args.algorithm == 'ida_star':
-        solver = IDAStarSolver(
+        # Parallel IDA* only takes its own options when more than one worker is asked for
+        ida_options = {}
+        SolverClass = IDAStarSolver
+        if args.workers > 1:
+            SolverClass = ParallelIDAStarSolver
+            ida_options = {'workers': args.workers, 'split_depth': args.split_depth}
+
+        solver = SolverClass(
+            map_from_yaml,
+            heuristic=heuristic_chosen,
+            deadlocks=active_deadlocks,
+            max_depth=args.max_depth,
+            debug=not args.no_visual,
+            push_level=args.push_level,
+            cache_size=args.cache_size,
+            deadlock_db=args.deadlock_db,
+            tt_size=args.tt_size,
+            **ida_options,
+            **budget
+        )
+        solution = solver.solve()
+        if args.workers <= 1 and not args.no_visual:
+            print(f"Transposition table: {solver.table.hits}/{solver.table.lookups} hits "
+                  f"({solver.table.hit_rate:.1%}), {len(solver.table)}/{solver.table.capacity} entries, "
+                  f"{solver.table.replacements} replacements")
+        if args.deadlock_db and not args.no_visual:
+            print(f"Learned deadlocks: {solver.deadlock_db.loaded} loaded, {len(solver.deadlock_db)} known, "
+                  f"{solver.deadlock_db.hits} hits")
+        # Counted over every iteration, the solver's own count restarts with each threshold
+        nodes_expanded = solver.result.nodes_expanded
+        if solution:
+            final_map = map_from_yaml.copy()
+            for move in solution:
+                final_map.apply_move(move)
+            pull_moves = final_map.undo_moves
+    elif args.algorithm == 'astar':
+        solver = AStarSolver(
             map_from_yaml,
             heuristic=heuristic_chosen,
             deadlocks=active_deadlocks,
-            debug=not args.no_visual
+            weight=args.weight,
+            debug=not args.no_visual,
+            push_level=args.push_level,
+            cache_size=args.cache_size,
+            **budget
+        )
+        solution = solver.solve()
+        nodes_expanded = solver.nodes_expanded
+        if solution:
+            final_map = map_from_yaml.copy()
+            for move in solution:
+                final_map.apply_move(move)
+            pull_moves = final_map.undo_moves
+    elif args.algorithm == 'bidirectional':
+        # Breadth-first from both ends, the heuristic is not used
+        solver = BidirectionalSolver(
+            map_from_yaml,
+            deadlocks=active_deadlocks,
+            debug=not args.no_visual,
+            push_level=args.push_level,
+            cache_size=args.cache_size,
+            **budget
         )
         solution = solver.solve()
-        #
+        nodes_expanded = solver.nodes_expanded
         if solution:
             final_map = map_from_yaml.copy()
             for move in solution:
                 final_map.apply_move(move)
             pull_moves = final_map.undo_moves
-            nodes_expanded = solver.nodes_expanded
+    elif args.chains > 1:  # simulated_annealing, several chains
+        solver = ParallelAnnealingSolver(
+            map_from_yaml,
+            heuristic=heuristic_chosen,
+            deadlocks=active_deadlocks,
+            chains=args.chains,
+            seed=args.seed,
+            initial_temps=args.sa_temps,
+            alphas=args.sa_alphas,
+            push_level=args.push_level,
+            cache_size=args.cache_size,
+            adaptive=args.adaptive_cooling,
+            window=args.window,
+            patience=args.patience,
+            tabu_tenure=args.tabu_tenure,
+            **budget
+        )
+        solution = solver.solve()
+        nodes_expanded = solver.nodes_expanded
+        pull_moves = solver.pull_moves
+        if not args.no_visual:
+            print(f"Chains (base seed {solver.seed}):")
+            for chain in solver.chains:
+                print(f"  #{chain['chain']} seed={chain['seed']} T0={chain['initial_temp']} alpha={chain['alpha']} "
+                      f"steps={chain['steps']} accepted={chain['accepted']} final_h={chain['final_h']} "
+                      f"solved={chain['solved']} cancelled={chain['cancelled']} {chain['elapsed']:.2f}s")
+                if args.adaptive_cooling:
+                    print(f"      reheats={chain['reheats']} restarts={chain['restarts']} best_h={chain['best_h']} "
+                          f"stop={chain['stop_reason']}")
+            print(f"Kept chain #{solver.best_chain['chain']}")
     else:  # simulated_annealing
         solver = SimulatedAnnealingSolver(
             map_from_yaml,
             heuristic=heuristic_chosen,
             deadlocks=active_deadlocks,
+            initial_temp=args.sa_temps[0],
+            push_level=args.push_level,
+            cache_size=args.cache_size,
+            seed=args.seed,
+            alpha=args.sa_alphas[0],
+            adaptive=args.adaptive_cooling,
+            window=args.window,
+            patience=args.patience,
+            tabu_tenure=args.tabu_tenure,
+            **budget
         )
         solution = solver.solve()
         nodes_expanded = solver.nodes_expanded
         pull_moves = solver.pull_moves
+        if not args.no_visual:
+            print(f"Seed: {solver.seed}")
+            print(f"Tabu rejections: {solver.stats['tabu_rejected']}, "
+                  f"loops cut: {solver.stats['loops_cut']} ({solver.stats['loop_moves']} moves)")
+            if args.adaptive_cooling:
+                stats = solver.stats
+                print(f"Adaptive cooling: {stats['reheats']} reheats, {stats['restarts']} restarts, "
+                      f"best h {stats['best_h']}, stopped by {stats['stop_reason']}")
+                for entry in solver.schedule_trace:
+                    if entry['event']:
+                        print(f"  step {entry['step']}: {entry['event']} to T={entry['temp']:.2f} "
+                              f"(acceptance {entry['acceptance']:.3f}, best h {entry['best_h']})")
+
+    if solution and args.optimize_solution:
+        optimizer = SolutionOptimizer(map_from_yaml, window=args.optimize_window, push_aware=args.minimize_pulls)
+        solution = optimizer.optimize(solution)
+        pull_moves = optimizer.pull_moves
+        if not args.no_visual:
+            print(f"Optimizer: {optimizer.original_moves} -> {len(solution)} moves, "
+                  f"{optimizer.original_pulls} -> {optimizer.pull_moves} pulls, {optimizer.shortcuts} shortcuts, "
+                  f"{optimizer.nodes_expanded} states searched in {optimizer.elapsed:.2f}s")
 
     elapsed = time.perf_counter() - start
     minutes, seconds = divmod(elapsed, 60)
 
+    result = solver.result
     if not args.no_visual:
         print(f"\nAlgorithm: {args.algorithm.upper()}")
         print(f"Heuristic: {args.heuristic}")
-        print(f"Solution found in {len(solution)} moves!")
+        print(f"Status: {result.status}")
+        if solution:
+            print(f"Solution found in {len(solution)} moves!")
+        else:
+            print(f"Best partial path: {len(result.moves)} moves, heuristic {result.best_h}")
         print(f"States expanded: {nodes_expanded}")
         print(f"Pull moves: {pull_moves}")
+        print(f"Heuristic cache: {solver.cache_hits} hits, {solver.cache_misses} misses")
         print(f"Time elapsed: {int(minutes)}m {int(seconds)}s")
 
     # When saving frames and GIFs:
@@ -322,8 +683,12 @@ def main():
     else:
         if not args.no_visual:
             print("\nNo solution found")
+            # The state the best partial path ends in
+            final_map = map_from_yaml.copy()
+            for move in result.moves:
+                final_map.apply_move(move)
             print(f"Final map state:")
-            print(map_from_yaml)
+            print(final_map)
         sys.exit(1)
 
 if __name__ == '__main__':
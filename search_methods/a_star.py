@@ -0,0 +1,119 @@
+from search_methods.solver import Solver, SOLVED, TIMEOUT, UNSOLVABLE
+from search_methods.heuristics import DEFAULT_CACHE_ENTRIES
+from sokoban.map import Map
+from sokoban.state import State
+
+from typing import Dict, List, Optional, Tuple, Union
+import heapq
+import math
+
+class AStarSolver(Solver):
+    """
+    Best-first search on f = g + weight * h, expanding every state once instead of re-searching
+    the tree for each threshold like IDA*. A weight of 1 gives plain A*, which returns an optimal
+    solution with an admissible heuristic; larger weights trade optimality for fewer expansions.
+
+    The open list is a heap of (f, h, insertion order, state key) entries. Only the states still
+    open are kept whole; every reached state keeps its best g and a parent pointer (parent key,
+    move), from which the solution is read back. States are identified by Solver.state_key, which
+    at push level normalizes the player to its reachable region, so walks never create duplicates.
+    The state with the smallest heuristic reached is the partial result when the budget runs out.
+    """
+    def __init__(self,
+                 map: Map,
+                 heuristic,
+                 deadlocks,
+                 weight: float = 1.0,
+                 debug: bool = False,
+                 push_level: bool = False,
+                 cache_size: int = DEFAULT_CACHE_ENTRIES,
+                 deadline: Optional[float] = None,
+                 max_nodes: Optional[int] = None
+                 ) -> None:
+        super().__init__(map, push_level, cache_size, deadline, max_nodes)
+        if weight < 1:
+            raise ValueError(f'A* weight must be at least 1, got {weight}')
+        self.heuristic = heuristic
+        self.deadlocks = deadlocks
+        self.weight = weight
+        self.debug = debug
+        self.path = []
+        self.nodes_expanded = 0
+
+        # Best g of every reached state, and the (parent key, move) it was reached with
+        self.g_score: Dict[int, int] = {}
+        self.parents: Dict[int, Tuple[Optional[int], Union[int, Tuple[int, int], None]]] = {}
+
+    def solve(self) -> Union[List[int], None]:
+        start = State.from_map(self.map)
+        self.start_budget()
+        self.nodes_expanded = 0
+        start_key = self.state_key(start)
+        h = self.heuristic(start, self.deadlocks, cache=self.heuristic_cache)
+        if h == math.inf:
+            self.finish(UNSOLVABLE, [], 0)
+            return None
+
+        self.g_score = {start_key: 0}
+        self.parents = {start_key: (None, None)}
+        open_states: Dict[int, State] = {start_key: start}
+        open_list = [(self.weight * h, h, 0, start_key)]
+        pushed = 1
+        best_h, best_key = h, start_key
+
+        while open_list:
+            if self.out_of_budget(self.nodes_expanded):
+                self.finish(TIMEOUT, self.expand_moves(start, self.solution_moves(best_key)), self.nodes_expanded, best_h)
+                return None
+
+            _, _, _, key = heapq.heappop(open_list)
+            # Entries left behind when a state was reached again with a smaller g
+            current_map = open_states.pop(key, None)
+            if current_map is None:
+                continue
+
+            self.nodes_expanded += 1
+            if current_map.is_solved():
+                self.path = self.expand_moves(start, self.solution_moves(key))
+                self.finish(SOLVED, self.path, self.nodes_expanded, 0)
+                return self.path
+
+            g = self.g_score[key] + 1
+            for move in self.successor_moves(current_map):
+                next_map = current_map.copy()
+                try:
+                    self.make_move(next_map, move)
+                except ValueError as e:
+                    if self.debug:
+                        print(f"Invalid move {move} attempted: {e}")
+                    continue
+
+                next_key = self.state_key(next_map)
+                if g >= self.g_score.get(next_key, math.inf):
+                    continue
+
+                h = self.heuristic(next_map, self.deadlocks, cache=self.heuristic_cache)
+                if h == math.inf:
+                    continue
+
+                # A smaller g reopens a state that was already expanded
+                self.g_score[next_key] = g
+                self.parents[next_key] = (key, move)
+                open_states[next_key] = next_map
+                heapq.heappush(open_list, (g + self.weight * h, h, pushed, next_key))
+                pushed += 1
+                if h < best_h:
+                    best_h, best_key = h, next_key
+
+        self.finish(UNSOLVABLE, self.expand_moves(start, self.solution_moves(best_key)), self.nodes_expanded, best_h)
+        return None
+
+    def solution_moves(self, key: int) -> List[Union[int, Tuple[int, int]]]:
+        """Follows the parent pointers from the state back to the start, returning the moves in order."""
+        moves = []
+        parent, move = self.parents[key]
+        while parent is not None:
+            moves.append(move)
+            parent, move = self.parents[parent]
+        moves.reverse()
+        return moves
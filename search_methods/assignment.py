@@ -0,0 +1,137 @@
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+from math import inf
+import numpy as np
+
+# Stand-in for infinite costs in assignment matrices, larger than any real sum of distances
+UNREACHABLE = 10 ** 9
+
+
+class IncrementalAssignment:
+    """
+    Minimal-cost assignment of rows (boxes) to distinct columns (targets), solved with the
+    Hungarian algorithm: shortest augmenting paths with dual potentials over a NumPy cost matrix, O(n^3).
+
+    The matrix is padded to a square one with zero-cost dummy rows, so that every column is matched
+    and the potentials prove the matching optimal. They are kept between calls: when only one row
+    changed since the previous call (a single box moved), that row is unassigned and re-augmented,
+    repairing the previous optimum in O(n^2) instead of solving again from scratch.
+    """
+    def __init__(self) -> None:
+        self.rows: List[Hashable] = []
+        self.row_index: Dict[Hashable, int] = {}
+        self.columns: Optional[tuple] = None
+        self.total = inf
+
+        # 1-indexed arrays, index 0 is the virtual row/column used to start each augmentation
+        self.cost: Optional[np.ndarray] = None
+        self.u: Optional[np.ndarray] = None
+        self.v: Optional[np.ndarray] = None
+        self.row_of_column: Optional[np.ndarray] = None
+        self.way: Optional[np.ndarray] = None
+
+        self.full_solves = 0
+        self.repairs = 0
+
+    def assign(self,
+               rows: Sequence[Hashable],
+               columns: Sequence[Hashable],
+               row_costs: Callable[[Hashable], List[float]]
+               ) -> float:
+        """
+        Returns the minimal total cost of assigning every row to a distinct column, inf if impossible.
+        row_costs(row) gives the costs of a row against every column, in order.
+        """
+        columns = tuple(columns)
+        if len(rows) > len(columns):
+            return inf
+
+        if columns == self.columns and len(rows) == len(self.rows):
+            added = [row for row in rows if row not in self.row_index]
+            if not added:
+                return self.total
+
+            if len(added) == 1:
+                kept = set(rows)
+                removed = next(row for row in self.rows if row not in kept)
+                index = self.row_index.pop(removed)
+                self.rows[index] = added[0]
+                self.row_index[added[0]] = index
+                return self.update_row(index, row_costs(added[0]))
+
+        self.rows = list(rows)
+        self.row_index = {row: index for index, row in enumerate(self.rows)}
+        self.columns = columns
+        return self.solve(np.array([row_costs(row) for row in self.rows], dtype=float).reshape(len(rows), len(columns)))
+
+    def solve(self, cost_matrix: np.ndarray) -> float:
+        """Solves the assignment from scratch, keeping the potentials for later repairs."""
+        self.full_solves += 1
+        number_of_rows, size = cost_matrix.shape
+
+        self.cost = np.zeros((size + 1, size + 1))
+        self.cost[1:number_of_rows + 1, 1:] = np.where(np.isinf(cost_matrix), UNREACHABLE, cost_matrix)
+        self.u = np.zeros(size + 1)
+        self.v = np.zeros(size + 1)
+        self.row_of_column = np.zeros(size + 1, dtype=int)
+        self.way = np.zeros(size + 1, dtype=int)
+
+        for row in range(1, size + 1):
+            self._augment(row)
+
+        return self._total()
+
+    def update_row(self, index: int, costs: List[float]) -> float:
+        """Replaces the costs of one row and repairs the optimal assignment with a single augmentation."""
+        self.repairs += 1
+        row = index + 1
+        self.cost[row, 1:] = [UNREACHABLE if cost == inf else cost for cost in costs]
+
+        # Unassign the row; the other rows keep feasible, tight potentials
+        column = self.row_of_column.tolist().index(row, 1)
+        self.row_of_column[column] = 0
+        self._augment(row)
+
+        return self._total()
+
+    def _augment(self, row: int) -> None:
+        """Assigns a free row along a shortest augmenting path (Dijkstra over reduced costs)."""
+        cost, u, v, row_of_column, way = self.cost, self.u, self.v, self.row_of_column, self.way
+
+        row_of_column[0] = row
+        column = 0
+        min_reduced = np.full(len(v), np.inf)
+        used = np.zeros(len(v), dtype=bool)
+
+        while True:
+            used[column] = True
+            current_row = row_of_column[column]
+            free = ~used
+
+            reduced = cost[current_row] - u[current_row] - v
+            better = free & (reduced < min_reduced)
+            min_reduced[better] = reduced[better]
+            way[better] = column
+
+            candidates = np.where(free, min_reduced, np.inf)
+            next_column = int(candidates.argmin())
+            delta = candidates[next_column]
+
+            u[row_of_column[used]] += delta
+            v[used] -= delta
+            min_reduced[free] -= delta
+
+            column = next_column
+            if row_of_column[column] == 0:
+                break
+
+        # Flip the assignments along the path back to the virtual column
+        while column:
+            previous = way[column]
+            row_of_column[column] = row_of_column[previous]
+            column = previous
+
+    def _total(self) -> float:
+        columns = np.arange(1, len(self.v))
+        total = float(self.cost[self.row_of_column[1:], columns].sum())
+        self.total = inf if total >= UNREACHABLE else total
+        return self.total
@@ -0,0 +1,215 @@
+from search_methods.solver import Solver, BudgetExhausted, SOLVED, TIMEOUT, UNSOLVABLE
+from search_methods.heuristics import DEFAULT_CACHE_ENTRIES
+from search_methods.deadlocks import compile_deadlocks
+from sokoban.board import OPPOSITE_MOVES
+from sokoban.map import Map
+from sokoban.moves import BOX_LEFT
+from sokoban.state import State
+
+from typing import Dict, List, Optional, Tuple, Union
+import math
+
+# Entry of a search side: parent key (None for a root) and the move that reached the state from it
+Parent = Tuple[Optional[int], Union[int, Tuple[int, int], None]]
+
+class BidirectionalSolver(Solver):
+    """
+    Breadth-first search from both ends of the solution at once.
+
+    The forward side starts from the level and applies the usual moves. The backward side starts
+    from the goal configurations, all boxes on the targets with the player in each region it can
+    walk in, and applies the reverse of the moves: a push is undone by a pull and a pull by a push,
+    so it pulls boxes away from the targets. Both sides record the states they reach in a table of
+    parent pointers, and the side with the smaller frontier is grown by one layer at a time. Once a
+    layer reaches a state the other side knows, the shortest meeting in that layer is kept and the
+    two halves are stitched: the forward moves up to it, then the backward moves reversed.
+
+    Every move can be undone, so the backward side records for each state the move that goes
+    back towards the goal. States are identified by Solver.state_key, so at push level the goals
+    are one per region and the search counts box moves.
+
+    Without a heuristic, the partial result of a solve out of budget is the path to the forward state
+    whose boxes are the fewest box moves away from the targets, each box counted to its nearest one.
+    """
+    def __init__(self,
+                 map: Map,
+                 deadlocks,
+                 debug: bool = False,
+                 push_level: bool = False,
+                 cache_size: int = DEFAULT_CACHE_ENTRIES,
+                 deadline: Optional[float] = None,
+                 max_nodes: Optional[int] = None
+                 ) -> None:
+        super().__init__(map, push_level, cache_size, deadline, max_nodes)
+        self.deadlocks = deadlocks
+        self.debug = debug
+        self.path = []
+        self.nodes_expanded = 0
+        # Forward state closest to the goal and its distance, the partial result of an unfinished solve
+        self.best_distance = math.inf
+        self.best_key: Optional[int] = None
+
+        # Parent pointers of the two sides; backward moves lead from a state towards the goal
+        self.forward: Dict[int, Parent] = {}
+        self.backward: Dict[int, Parent] = {}
+
+    def goal_states(self, start: State) -> List[State]:
+        """Boxes on every target, with the player in each region of the free floor."""
+        board = start.board
+        if len(start.boxes) != len(board.target_cells):
+            raise ValueError('Bidirectional search needs as many boxes as targets')
+
+        boxes = frozenset(board.target_cells)
+        goals = []
+        covered = set()
+        for cell in range(board.size):
+            if board.is_wall[cell] or cell in boxes or cell in covered:
+                continue
+            goal = State(board, cell, boxes)
+            region = goal.reachable_cells()
+            covered.update(region)
+            if self.push_level:
+                goals.append(goal)
+            else:
+                goals.extend(State(board, player, boxes) for player in sorted(region))
+        return goals
+
+    def solve(self) -> Union[List[int], None]:
+        start = State.from_map(self.map)
+        self.start_budget()
+        self.nodes_expanded = 0
+        # Without a box for every target there is no goal configuration to search back from
+        if len(start.boxes) != len(start.board.target_cells):
+            self.finish(UNSOLVABLE, [], 0)
+            return None
+        engine = compile_deadlocks(start.board, self.deadlocks)
+        if engine.is_deadlock(start):
+            self.finish(UNSOLVABLE, [], 0)
+            return None
+
+        start_key = self.state_key(start)
+        self.best_key = start_key
+        self.best_distance = self.box_distance(start)
+        self.forward = {start_key: (None, None)}
+        self.backward = {}
+        forward_layer = [start]
+        backward_layer = []
+        for goal in self.goal_states(start):
+            goal_key = self.state_key(goal)
+            if goal_key not in self.backward:
+                self.backward[goal_key] = (None, None)
+                backward_layer.append(goal)
+
+        meeting = start_key if start_key in self.backward else None
+
+        try:
+            while meeting is None and forward_layer and backward_layer:
+                if len(forward_layer) <= len(backward_layer):
+                    forward_layer, meeting = self.expand_layer(forward_layer, self.forward, self.backward, engine, False)
+                else:
+                    backward_layer, meeting = self.expand_layer(backward_layer, self.backward, self.forward, engine, True)
+        except BudgetExhausted:
+            self.finish(TIMEOUT, self.partial_moves(start), self.nodes_expanded, self.best_distance)
+            return None
+
+        if meeting is None:
+            self.finish(UNSOLVABLE, self.partial_moves(start), self.nodes_expanded, self.best_distance)
+            return None
+
+        moves = self.trace(self.forward, meeting)
+        moves.reverse()
+        moves.extend(self.trace(self.backward, meeting))
+        self.path = self.expand_moves(start, moves)
+        self.finish(SOLVED, self.path, self.nodes_expanded, 0)
+        return self.path
+
+    def box_distance(self, state: State) -> float:
+        """Box moves needed to bring every box to its nearest target, ignoring the other boxes."""
+        nearest = state.board.nearest_box_distance
+        return sum(nearest[box] for box in state.boxes)
+
+    def partial_moves(self, start: State) -> List[int]:
+        """Moves from the start to the forward state closest to the goal."""
+        moves = self.trace(self.forward, self.best_key)
+        moves.reverse()
+        return self.expand_moves(start, moves)
+
+    def expand_layer(self,
+                     layer: List[State],
+                     parents: Dict[int, Parent],
+                     other: Dict[int, Parent],
+                     engine,
+                     backward: bool
+                     ) -> Tuple[List[State], Optional[int]]:
+        """
+        Expands every state of the layer once. Returns the next layer and the key where the
+        two sides met with the fewest moves in total, None if they did not.
+        """
+        next_layer = []
+        meeting = None
+        meeting_cost = math.inf
+        for current_map in layer:
+            if self.out_of_budget(self.nodes_expanded):
+                raise BudgetExhausted()
+            self.nodes_expanded += 1
+            key = self.state_key(current_map)
+            for move in self.successor_moves(current_map):
+                next_map = current_map.copy()
+                try:
+                    self.make_move(next_map, move)
+                except ValueError as e:
+                    if self.debug:
+                        print(f"Invalid move {move} attempted: {e}")
+                    continue
+
+                next_key = self.state_key(next_map)
+                if next_key in parents or engine.is_deadlock(next_map):
+                    continue
+
+                # The backward side records the move leading back to the state it came from
+                parents[next_key] = (key, self.reverse_move(next_map, move) if backward else move)
+                next_layer.append(next_map)
+                # Only a box move changes the distance of the boxes
+                if not backward and next_map.moved_box != -1:
+                    distance = self.box_distance(next_map)
+                    if distance < self.best_distance:
+                        self.best_distance, self.best_key = distance, next_key
+
+                if next_key in other:
+                    cost = self.depth(parents, next_key) + self.depth(other, next_key)
+                    if cost < meeting_cost:
+                        meeting, meeting_cost = next_key, cost
+
+        return next_layer, meeting
+
+    def reverse_move(self, state: State, move: Union[int, Tuple[int, int]]) -> Union[int, Tuple[int, int]]:
+        """
+        Move that undoes the move which led to the state: the opposite walk, or the opposite box move,
+        which pulls a pushed box back and pushes a pulled box back.
+        """
+        if self.push_level:
+            _, box_move = move
+            return state.player, OPPOSITE_MOVES[box_move - 4] + 4
+        if move >= BOX_LEFT or state.moved_box >= 0:
+            direction = move - 4 if move >= BOX_LEFT else move
+            return OPPOSITE_MOVES[direction] + 4
+        return OPPOSITE_MOVES[move]
+
+    @staticmethod
+    def depth(parents: Dict[int, Parent], key: int) -> int:
+        """Number of moves from the root of the side to the state."""
+        depth = 0
+        while parents[key][0] is not None:
+            key = parents[key][0]
+            depth += 1
+        return depth
+
+    @staticmethod
+    def trace(parents: Dict[int, Parent], key: int) -> List[Union[int, Tuple[int, int]]]:
+        """Moves recorded on the way from the state back to the root of its side, in that order."""
+        moves = []
+        parent, move = parents[key]
+        while parent is not None:
+            moves.append(move)
+            parent, move = parents[parent]
+        return moves
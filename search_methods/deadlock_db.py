@@ -0,0 +1,191 @@
+from search_methods.deadlocks import compile_deadlocks
+from sokoban.board import StaticBoard
+from sokoban.state import State
+
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+import hashlib
+import json
+import os
+import tempfile
+
+# Bound on the dead patterns kept per level, rules and heuristic
+MAX_LEARNED_DEADLOCKS = 200_000
+
+# Box moves searched to prove that the boxes left after dropping one are still dead
+PROOF_NODE_LIMIT = 1000
+
+def level_hash(board: StaticBoard) -> str:
+    """Hash of the static part of a level (size, walls, targets), the same in every run"""
+    description = f'{board.length}x{board.width};walls={sorted(board.wall_cells)};targets={sorted(board.target_cells)}'
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+class DeadlockDatabase:
+    """
+    Dead patterns learned by IDA* and kept on disk between runs.
+
+    A position is learned when the search proves that no solution can be reached from it:
+    every successor is a deadlock or already proven dead, without cycles back above it, depth cuts
+    or transposition cuts. It is then shrunk to the boxes that make it dead: one box at a time is
+    dropped while a small search, pruned by the same deadlock rules, still proves that the boxes
+    left can not all reach targets. Removing boxes only frees the way, so any position holding
+    those boxes on those cells is dead too, whatever the other boxes.
+
+    A pattern is stored as (smallest cell of the player's region, box cells), the region being the
+    one the player walks in when only the pattern's boxes are on the board. Patterns are kept under
+    a key made of the level hash, the heuristic and the deadlock rules the proofs relied on.
+
+    On later solves of the same level they are loaded at startup and used as an extra deadlock rule:
+    a state is dead when its boxes include those of a pattern and the player is in its region.
+    """
+    def __init__(self, path: Optional[str], board: StaticBoard, heuristic_name: str, rules: Iterable[str]) -> None:
+        self.path = path
+        self.board = board
+        self.key = f'{level_hash(board)}:{heuristic_name}:{"+".join(sorted(rules))}'
+        self.engine = compile_deadlocks(board, rules)
+
+        # Patterns as (box mask, smallest cell of the player's region, box cells), with the indices of
+        # the patterns each cell is part of, and the (player, box mask) pairs already known
+        self.patterns: List[Tuple[int, int, FrozenSet[int]]] = []
+        self.patterns_of_cell: Dict[int, List[int]] = {}
+        self.known: Set[Tuple[int, int]] = set()
+        self.new_positions: List[Tuple[int, List[int]]] = []
+        self.loaded = 0
+        self.hits = 0
+
+        if path is not None and os.path.exists(path):
+            for player, boxes in self.read_file().get(self.key, []):
+                self.insert(player, boxes)
+            self.loaded = len(self)
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def read_file(self) -> dict:
+        with open(self.path, 'r') as file:
+            return json.load(file)
+
+    def insert(self, player: int, boxes: Iterable[int]) -> bool:
+        boxes = frozenset(boxes)
+        mask = sum(1 << box for box in boxes)
+        if (player, mask) in self.known:
+            return False
+        self.known.add((player, mask))
+        for box in boxes:
+            self.patterns_of_cell.setdefault(box, []).append(len(self.patterns))
+        self.patterns.append((mask, player, boxes))
+        return True
+
+    def matches(self, state: State) -> bool:
+        """
+        Checks the state against the patterns. Only those holding the box moved last can match,
+        which assumes the state it was moved from was checked: other moves leave the pattern's boxes
+        and the player's region around them as they were. States that do not know their last move,
+        like the root, are checked against every pattern.
+        """
+        moved_box = state.moved_box
+        if moved_box is None:
+            candidates = range(len(self.patterns))
+        elif moved_box < 0:
+            return False
+        else:
+            candidates = self.patterns_of_cell.get(moved_box, ())
+
+        box_mask = state.box_mask
+        for index in candidates:
+            mask, player, boxes = self.patterns[index]
+            if box_mask & mask == mask and min(State(self.board, state.player, boxes).reachable_cells()) == player:
+                return True
+        return False
+
+    def is_dead(self, state: State) -> bool:
+        """Checks if the state holds a pattern already proven dead"""
+        if not self.patterns or not self.matches(state):
+            return False
+        self.hits += 1
+        return True
+
+    def add(self, state: State) -> None:
+        """Records the pattern of a position proven dead"""
+        if len(self.patterns) >= MAX_LEARNED_DEADLOCKS:
+            return
+        boxes = self.dead_subset(state.player, state.boxes)
+        player = min(State(self.board, state.player, boxes).reachable_cells())
+        if self.insert(player, boxes):
+            self.new_positions.append((player, sorted(boxes)))
+
+    def take_learned(self) -> Tuple[List[Tuple[int, List[int]]], int]:
+        """Hands over the positions learned and the hits counted since the last call, e.g. by a parallel worker"""
+        learned, hits = self.new_positions, self.hits
+        self.new_positions, self.hits = [], 0
+        return learned, hits
+
+    def merge(self, learned: List[Tuple[int, List[int]]], hits: int) -> None:
+        """Adds what take_learned handed over in another process, to be saved with the positions learned here"""
+        for player, boxes in learned:
+            if len(self.patterns) < MAX_LEARNED_DEADLOCKS and self.insert(player, boxes):
+                self.new_positions.append((player, boxes))
+        self.hits += hits
+
+    def dead_subset(self, player: int, boxes: FrozenSet[int]) -> FrozenSet[int]:
+        """Drops the boxes of a dead position one at a time, as long as the ones left are proven dead."""
+        for box in sorted(boxes):
+            if len(boxes) > 1 and self.proves_dead(player, boxes - {box}):
+                boxes = boxes - {box}
+        return boxes
+
+    def proves_dead(self, player: int, boxes: FrozenSet[int]) -> bool:
+        """
+        Searches the box moves from the position until its boxes are all on targets. Returns True
+        when the search runs out of states without that, False once it gets there or after
+        PROOF_NODE_LIMIT states.
+        """
+        is_target = self.board.is_target
+        start = State(self.board, player, boxes)
+        if all(is_target[box] for box in boxes):
+            return False
+        if self.engine.is_deadlock(start) or self.matches(start):
+            return True
+
+        seen = {start.canonical_key()}
+        stack = [start]
+        searched = 0
+        while stack:
+            searched += 1
+            if searched > PROOF_NODE_LIMIT:
+                return False
+            state = stack.pop()
+            for cell, move in state.box_moves():
+                next_state = state.copy()
+                try:
+                    next_state.make_box_move(cell, move)
+                except ValueError:
+                    continue
+                if all(is_target[box] for box in next_state.boxes):
+                    return False
+
+                key = next_state.canonical_key()
+                if key in seen:
+                    continue
+                seen.add(key)
+                if not self.engine.is_deadlock(next_state) and not self.matches(next_state):
+                    stack.append(next_state)
+        return True
+
+    def save(self) -> None:
+        """Merges the positions learned in this run into the file, written atomically"""
+        if self.path is None or not self.new_positions:
+            return
+
+        data = self.read_file() if os.path.exists(self.path) else {}
+        positions = data.setdefault(self.key, [])
+        known = {(player, tuple(boxes)) for player, boxes in positions}
+        for player, boxes in self.new_positions:
+            if (player, tuple(boxes)) not in known and len(positions) < MAX_LEARNED_DEADLOCKS:
+                positions.append([player, boxes])
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary_path, self.path)
+        self.new_positions = []
@@ -0,0 +1,325 @@
+from sokoban.board import StaticBoard
+from sokoban.state import State
+from sokoban.moves import LEFT, RIGHT, UP, DOWN
+
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+from weakref import WeakKeyDictionary
+from math import inf
+
+# Rule names accepted by compile_deadlocks, as passed on from the command line flags
+DEADLOCK_RULES = ('static', 'corner', 'tunnel', 'edge', '2x2', 'freeze')
+
+# Freeze checks look at the boxes within this many cells of the box that moved, so the verdict
+# only depends on a small local pattern and can be memoized
+FREEZE_RADIUS = 2
+
+# Bound of the memo of frozen patterns, it is emptied when full
+FREEZE_MEMO_ENTRIES = 1 << 16
+
+class DeadlockEngine:
+    """
+    Deadlock rules of one level, compiled once into bitmasks over the cells (bit cell = x * width + y).
+
+    Every rule that only depends on where a single box stands (dead squares, corners, tunnels, edges)
+    is folded into one mask of forbidden cells, so checking a state is an AND against its box bitset.
+    The 2x2 rule is a few shifts and ANDs of the same bitset.
+
+    After a move only the box that moved can have created a deadlock, so states that record their
+    moved box are checked locally: one bit test plus the 2x2 squares around that box.
+
+    The freeze rule follows the boxes around the moved one, so it is memoized instead: its verdicts are
+    stored per (cell, boxes in the window around the cell) pattern for as long as the engine lives,
+    which is one search configuration of one level.
+    """
+    def __init__(self, board: StaticBoard, rules: Iterable[str]) -> None:
+        self.rules: FrozenSet[str] = frozenset(rules)
+        unknown = self.rules.difference(DEADLOCK_RULES)
+        if unknown:
+            raise ValueError(f'Unknown deadlock rules: {", ".join(sorted(unknown))}')
+
+        self.board = board
+        self.width = board.width
+        self.target_mask = self.mask(board.target_cells)
+        # Cells a box may stand on without being solved: neither a wall nor a target
+        self.floor_mask = self.mask(
+            cell for cell in range(board.size) if not board.is_wall[cell] and not board.is_target[cell]
+        )
+
+        self.dead_squares_mask = self.mask(board.dead_cells)
+        self.corner_mask = self.mask(self.compute_corner_cells())
+        self.tunnel_mask = self.mask(self.compute_tunnel_cells())
+        self.edge_mask = self.mask(self.compute_edge_cells())
+        self.square_corners_mask = self.mask(self.compute_square_corners())
+        self.squares_of_cell = self.compute_squares_of_cells()
+
+        rule_masks = {
+            'static': self.dead_squares_mask,
+            'corner': self.corner_mask,
+            'tunnel': self.tunnel_mask,
+            'edge': self.edge_mask,
+        }
+        self.dead_mask = 0
+        for rule in self.rules:
+            self.dead_mask |= rule_masks.get(rule, 0)
+        self.dead_mask &= self.floor_mask
+        self.check_squares = '2x2' in self.rules
+
+        self.check_freeze = 'freeze' in self.rules
+        if self.check_freeze:
+            # Cells no box move, push or pull, can bring a box to a target from
+            self.is_dead_cell = [distance == inf for distance in board.nearest_box_distance]
+            move_table = board.move_table
+            # Per cell, the neighbouring cells along x and along y (-1 for a wall or the outside)
+            self.freeze_axes = [
+                ((move_table[UP][cell], move_table[DOWN][cell]), (move_table[LEFT][cell], move_table[RIGHT][cell]))
+                for cell in range(board.size)
+            ]
+            self.freeze_windows = self.compute_freeze_windows()
+            self.freeze_memo: Dict[Tuple[int, int], bool] = {}
+            self.freeze_memo_hits = 0
+
+    @staticmethod
+    def mask(cells: Iterable[int]) -> int:
+        """Bitset of the cells"""
+        result = 0
+        for cell in cells:
+            result |= 1 << cell
+        return result
+
+    def is_deadlock(self, state: State) -> bool:
+        """
+        Checks the state against every compiled rule. Only the neighbourhood of the box moved last is
+        examined, which assumes the parent state passed the check: searches never expand a deadlocked state.
+        States that do not know their last move, like the root, get a full scan.
+        """
+        moved_box = state.moved_box
+        if moved_box is None:
+            return self.is_deadlock_full(state)
+        if moved_box < 0:
+            # A walk of the player moves no box and can not create a deadlock
+            return False
+        return self.is_local_deadlock(state.box_mask, moved_box)
+
+    def is_local_deadlock(self, box_mask: int, cell: int) -> bool:
+        """Checks only the patterns the box on the cell is part of"""
+        if self.dead_mask >> cell & 1:
+            return True
+
+        if self.check_squares:
+            free_boxes = box_mask & self.floor_mask
+            for square in self.squares_of_cell[cell]:
+                if free_boxes & square == square:
+                    return True
+
+        if self.check_freeze and self.is_freeze_deadlock(box_mask, cell):
+            return True
+
+        return False
+
+    def is_deadlock_full(self, state: State) -> bool:
+        """Checks every box of the state against every compiled rule"""
+        box_mask = state.box_mask
+        if box_mask & self.dead_mask:
+            return True
+
+        if self.check_squares:
+            # A box still to solve whose right, lower and diagonal neighbours are boxes still to solve as well
+            free_boxes = box_mask & self.floor_mask
+            width = self.width
+            squares = free_boxes & (free_boxes >> 1) & (free_boxes >> width) & (free_boxes >> (width + 1))
+            if squares & self.square_corners_mask:
+                return True
+
+        if self.check_freeze:
+            for box in state.boxes:
+                if self.is_freeze_deadlock(box_mask, box):
+                    return True
+
+        return False
+
+    def is_freeze_deadlock(self, box_mask: int, cell: int) -> bool:
+        """
+        Checks if the box on the cell, or a box frozen because of it, can move along neither axis,
+        pinned by walls, dead squares or other frozen boxes, while one of the boxes frozen with it is off target
+        """
+        local_boxes = box_mask & self.freeze_windows[cell]
+        key = (cell, local_boxes)
+        result = self.freeze_memo.get(key)
+        if result is not None:
+            self.freeze_memo_hits += 1
+            return result
+
+        # A box frozen on its own on a target is fine, but it may pin down a neighbour that is not
+        is_target = self.board.is_target
+        neighbours = self.board.neighbours
+        result = False
+        examined = {cell}
+        stack = [cell]
+        while stack and not result:
+            box = stack.pop()
+            frozen_boxes: List[int] = []
+            if not self.is_frozen(box, local_boxes, set(), frozen_boxes):
+                continue
+
+            result = any(not is_target[frozen] for frozen in frozen_boxes)
+            for neighbour in neighbours[box]:
+                if local_boxes >> neighbour & 1 and neighbour not in examined:
+                    examined.add(neighbour)
+                    stack.append(neighbour)
+
+        if len(self.freeze_memo) >= FREEZE_MEMO_ENTRIES:
+            self.freeze_memo.clear()
+        self.freeze_memo[key] = result
+        return result
+
+    def is_frozen(self, cell: int, box_mask: int, pinned: Set[int], frozen_boxes: List[int]) -> bool:
+        """
+        Checks if the box on the cell is blocked along both axes. While its neighbours are examined the box
+        counts as a wall, which stops the recursion from going around in circles; boxes found frozen stay walls.
+        Boxes outside of box_mask are ignored, which can only miss a freeze, never report a false one.
+        """
+        pinned.add(cell)
+        found = len(frozen_boxes)
+        for first, second in self.freeze_axes[cell]:
+            if not self.is_axis_blocked(first, second, box_mask, pinned, frozen_boxes):
+                # Boxes found frozen while this one counted as a wall were only frozen on that assumption
+                for box in frozen_boxes[found:]:
+                    pinned.discard(box)
+                del frozen_boxes[found:]
+                pinned.discard(cell)
+                return False
+        frozen_boxes.append(cell)
+        return True
+
+    def is_axis_blocked(self, first: int, second: int, box_mask: int, pinned: Set[int], frozen_boxes: List[int]) -> bool:
+        """Checks if a box between the two cells can not be pushed along their axis"""
+        # A wall on either side
+        if first < 0 or second < 0 or first in pinned or second in pinned:
+            return True
+
+        # Pushing either way would bring the box on a dead square
+        if self.is_dead_cell[first] and self.is_dead_cell[second]:
+            return True
+
+        # A frozen box on either side
+        for neighbour in (first, second):
+            if box_mask >> neighbour & 1 and self.is_frozen(neighbour, box_mask, pinned, frozen_boxes):
+                return True
+
+        return False
+
+    def compute_corner_cells(self) -> List[int]:
+        """Cells blocked on one side along x and one side along y, by walls or the border of the map"""
+        board = self.board
+        cells = []
+        for cell, (x, y) in enumerate(board.coords):
+            if board.is_wall[cell] or board.is_target[cell]:
+                continue
+
+            blocked_x = (x - 1, y) in board.walls or x - 1 < 0 or (x + 1, y) in board.walls or x + 1 >= board.length
+            blocked_y = (x, y - 1) in board.walls or y - 1 < 0 or (x, y + 1) in board.walls or y + 1 >= board.width
+            if blocked_x and blocked_y:
+                cells.append(cell)
+        return cells
+
+    def compute_tunnel_cells(self) -> List[int]:
+        """
+        Cells of tunnels without a target: maximal runs along y of cells walled in on both sides along x,
+        and closed by a wall or the border at both ends, so a box inside can only slide along the tunnel.
+        A run open at an end is left out, the box can still be pushed or pulled out of it there.
+        """
+        board = self.board
+        cells = []
+        for x in range(1, board.length - 1):
+            segment: List[int] = []
+            has_target = False
+            closed_start = False
+            for y in range(board.width + 1):
+                in_tunnel = (
+                    y < board.width
+                    and (x, y) not in board.walls
+                    and (x - 1, y) in board.walls
+                    and (x + 1, y) in board.walls
+                )
+                if in_tunnel:
+                    cell = board.index(x, y)
+                    if not segment:
+                        closed_start = y == 0 or (x, y - 1) in board.walls
+                    segment.append(cell)
+                    has_target = has_target or board.is_target[cell]
+                    continue
+
+                closed_end = y == board.width or (x, y) in board.walls
+                if segment and not has_target and closed_start and closed_end:
+                    cells.extend(segment)
+                segment = []
+                has_target = False
+        return cells
+
+    def compute_edge_cells(self) -> List[int]:
+        """Cells on the border of the map with no target on the same border row or column"""
+        board = self.board
+        target_rows = {tx for tx, _ in board.targets}
+        target_columns = {ty for _, ty in board.targets}
+
+        cells = []
+        for cell, (x, y) in enumerate(board.coords):
+            if board.is_wall[cell] or board.is_target[cell]:
+                continue
+
+            on_row_edge = x == 0 or x == board.length - 1
+            on_column_edge = y == 0 or y == board.width - 1
+            if not on_row_edge and not on_column_edge:
+                continue
+
+            aligned = (on_row_edge and x in target_rows) or (on_column_edge and y in target_columns)
+            if not aligned:
+                cells.append(cell)
+        return cells
+
+    def compute_square_corners(self) -> List[int]:
+        """Top-left cells of the 2x2 squares that fit on the map, flat indices would otherwise wrap to the next row"""
+        board = self.board
+        return [board.index(x, y) for x in range(board.length - 1) for y in range(board.width - 1)]
+
+    def compute_squares_of_cells(self) -> List[List[int]]:
+        """Per cell, the masks of the 2x2 squares of floor cells off target that contain it"""
+        board = self.board
+        width = board.width
+        squares_of_cell: List[List[int]] = [[] for _ in range(board.size)]
+        for corner in self.compute_square_corners():
+            cells = (corner, corner + 1, corner + width, corner + width + 1)
+            square = self.mask(cells)
+            if square & self.floor_mask != square:
+                continue
+            for cell in cells:
+                squares_of_cell[cell].append(square)
+        return squares_of_cell
+
+    def compute_freeze_windows(self) -> List[int]:
+        """Per cell, the mask of the cells within FREEZE_RADIUS of it along both axes"""
+        board = self.board
+        windows = []
+        for x, y in board.coords:
+            windows.append(self.mask(
+                board.index(wx, wy)
+                for wx in range(max(0, x - FREEZE_RADIUS), min(board.length, x + FREEZE_RADIUS + 1))
+                for wy in range(max(0, y - FREEZE_RADIUS), min(board.width, y + FREEZE_RADIUS + 1))
+            ))
+        return windows
+
+# Engines are compiled once per level board and set of rules
+_engines: "WeakKeyDictionary[StaticBoard, Dict[FrozenSet[str], DeadlockEngine]]" = WeakKeyDictionary()
+
+def compile_deadlocks(board: StaticBoard, rules: Iterable[str]) -> DeadlockEngine:
+    """Returns the deadlock engine of the board for the rules, compiling it on first use"""
+    engines = _engines.get(board)
+    if engines is None:
+        engines = _engines[board] = {}
+
+    # The order the rules are given in does not matter
+    key = frozenset(rules) if rules else frozenset()
+    engine = engines.get(key)
+    if engine is None:
+        engine = engines[key] = DeadlockEngine(board, key)
+    return engine
@@ -1,37 +1,95 @@
 import math
-from collections import deque
-from typing import Tuple, Set, Dict, List
-from sokoban.map import Map
+from typing import Callable, Tuple, FrozenSet, List, Optional
+from sokoban.state import State
 from sokoban.moves import LEFT, RIGHT, UP, DOWN
+from search_methods.assignment import IncrementalAssignment, UNREACHABLE
+from search_methods.deadlocks import compile_deadlocks
+from search_methods.pattern_database import pattern_database_for
 from scipy.optimize import linear_sum_assignment
+from weakref import WeakKeyDictionary
+from collections import OrderedDict
 import itertools
 from math import inf
 
-###################################### HEURISTICS ######################################
+# Up to this many boxes, enumerating the orderings is cheaper than setting up an assignment
+MAX_ENUMERATED_BOXES = 3
+
+# One incremental assignment per level board, so consecutive states of a search repair the previous matching
+_matchings = WeakKeyDictionary()
+
+# Default bound of a heuristic cache, in entries (roughly 150 bytes each)
+DEFAULT_CACHE_ENTRIES = 1 << 17
 
-def total_manhattan_distance(map: Map, deadlocks) -> int:
-    deadlock_checkers = configure_deadlocks(map, deadlocks)
+###################################### CACHING #########################################
 
-    if deadlock_checkers:
-        for deadlock_checker in deadlock_checkers:
-            if deadlock_checker(map):
-                return inf
+class HeuristicCache:
+    """
+    Bounded LRU memo of the box-only part of a heuristic (deadlock verdict and box distances),
+    keyed by the Zobrist key of the box positions. The player-dependent terms are always computed fresh.
+    The verdict of a state checked only around its last box move is stored like a full one, which holds
+    as long as the searches never move on from a state found dead, starting with the root.
+    A cache belongs to one heuristic with one set of deadlock rules, so each solver owns its own.
+    """
+    def __init__(self, max_entries: int = DEFAULT_CACHE_ENTRIES) -> None:
+        if max_entries <= 0:
+            raise ValueError('The heuristic cache needs room for at least one entry')
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, state: State, compute: Callable[[State], float]) -> float:
+        """Returns the cached value for the boxes of the state, computing and storing it on a miss."""
+        key = state.box_key
+        entries = self.entries
+        value = entries.get(key)
+        if value is not None:
+            self.hits += 1
+            entries.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = compute(state)
+        entries[key] = value
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+def box_cost(state: State, cache: Optional[HeuristicCache], compute: Callable[[State], float]) -> float:
+    """Box-only part of a heuristic, memoized when a cache is given."""
+    if cache is None:
+        return compute(state)
+    return cache.lookup(state, compute)
+
+###################################### HEURISTICS ######################################
+
+def total_manhattan_distance(map: State, deadlocks) -> int:
+    if compile_deadlocks(map.board, deadlocks).is_deadlock(map):
+        return inf
             
     """Calculate sum of Manhattan distances from boxes to nearest targets"""
+    # The nearest-target distance of every cell is precomputed on the board
+    nearest_manhattan = map.board.nearest_manhattan
     total = 0
-    for box in map.positions_of_boxes.keys():
-        min_dist = float('inf')
-        for target in map.targets:
-            dist = abs(box[0] - target[0]) + abs(box[1] - target[1])
-            if dist < min_dist:
-                min_dist = dist
-        total += min_dist
+    for box in map.boxes:
+        total += nearest_manhattan[box]
     return total
 
-def simulated_annealing_heuristic(map_obj: Map,
+def simulated_annealing_heuristic(map_obj: State,
                                 deadlocks,
                                 w_player: float = 0.5,
-                                w_undo: float = 10.0
+                                w_undo: float = 10.0,
+                                cache: Optional[HeuristicCache] = None
                                 ) -> float:
     """
     Annealing-tailored heuristic:
@@ -39,25 +97,35 @@ def simulated_annealing_heuristic(map_obj: Map,
       - Adds player→box distance term.
       - Penalizes any “undo” moves taken so far.
     """
+    total_sq = box_cost(map_obj, cache, lambda state: squared_assignment_cost(state, deadlocks))
+    if total_sq == inf or not map_obj.boxes or not map_obj.board.target_list:
+        return total_sq
 
-    deadlock_checkers = configure_deadlocks(map_obj, deadlocks)
+    # 4) player→nearest‐box
+    dist_pb = min(map(map_obj.board.manhattan_row(map_obj.player).__getitem__, map_obj.boxes))
 
-    if deadlock_checkers:
-        for deadlock_checker in deadlock_checkers:
-            if deadlock_checker(map_obj):
-                return inf
+    # 5) undo‐moves penalty
+    u_penalty = map_obj.undo_moves
+
+    return total_sq + w_player * dist_pb + w_undo * u_penalty
+
+def squared_assignment_cost(map_obj: State, deadlocks) -> float:
+    """Box part of simulated_annealing_heuristic: squared Manhattan distances of the optimal assignment."""
+    if compile_deadlocks(map_obj.board, deadlocks).is_deadlock(map_obj):
+        return inf
             
     # 1) build cost matrix of manhattan distances
-    boxes   = list(map_obj.positions_of_boxes.keys())
-    targets = map_obj.targets
-    n, m    = len(boxes), len(targets)
+    # sorted, so ties between assignments break the same way for a given set of boxes
+    boxes   = sorted(map_obj.boxes)
+    distances = map_obj.board.manhattan_distances
+    n, m    = len(boxes), len(distances)
     if n == 0 or m == 0:
         return 0.0
 
     # cost[i][j] = |box_i - target_j|
-    cost = [[ abs(bx - tx) + abs(by - ty)
-              for (tx, ty) in targets ]
-            for (bx, by) in boxes ]
+    cost = [[ target_distances[box]
+              for target_distances in distances ]
+            for box in boxes ]
 
     # 2) optimal assignment
     row_ind, col_ind = linear_sum_assignment(cost)
@@ -68,100 +136,83 @@ def simulated_annealing_heuristic(map_obj: Map,
         d = cost[i][j]
         total_sq += d*d
 
-    # 4) player→nearest‐box
-    px, py = map_obj.player.x, map_obj.player.y
-    dist_pb = min(abs(px - bx) + abs(py - by) for bx,by in boxes)
+    return total_sq
 
-    # 5) undo‐moves penalty
-    u_penalty = map_obj.undo_moves
-
-    return total_sq + w_player * dist_pb + w_undo * u_penalty
+def hungarian_assignment(map: State, deadlocks=None, cache: Optional[HeuristicCache] = None) -> float:
+    """
+    Lower bound of the box moves left: optimal box→target assignment over the box distances.
+    deadlocks is only taken for the common heuristic signature, ida_star_heuristic adds the checks.
+    """
+    return box_cost(map, cache, box_assignment_cost)
 
-def hungarian_assignment(map: Map) -> float:
-    width, length = map.width, map.length
+def box_assignment_cost(map: State) -> float:
+    boxes: List[int] = list(map.boxes)
 
-    obstacles: Set[Tuple[int, int]] = set(map.obstacles)
-    targets: List[Tuple[int, int]] = list(map.targets)
-    boxes: List[Tuple[int, int]] = list(map.positions_of_boxes.keys())
+    # Box-move distances from every cell to every target are computed once per level by the board
+    distances: List[List[float]] = map.board.box_distances
 
     number_of_boxes = len(boxes)
-    number_of_targets = len(targets)
+    number_of_targets = len(distances)
     if number_of_boxes == 0 or number_of_targets == 0:
         return 0.0
-    
-    # BFS from all targets to compute distances ignoring boxes
-    distances: Dict[Tuple[int, int], int] = {}
-    visited: Set[Tuple[int, int]] = set()
-    queue = deque()
-
-    for tx, ty in targets:
-        queue.append((tx, ty, 0))
-        visited.add((tx, ty))
-
-    while queue:
-        x, y, d = queue.popleft()
-        distances[(x, y)] = d
-
-        for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-            nx, ny = x + dx, y + dy
-            if (0 <= nx < length and 0 <= ny < width and
-                    (nx, ny) not in visited and (nx, ny) not in obstacles):
-                visited.add((nx, ny))
-                queue.append((nx, ny, d + 1))
 
     # Build cost matrix: shape (n_boxes, n_targets)
     cost_matrix = [[
-        distances.get((bx, by), math.inf)
-        for (tx, ty) in targets
-    ] for (bx, by) in boxes]
+        target_distances[box]
+        for target_distances in distances
+    ] for box in boxes]
 
     # Use Hungarian algorithm for minimal assignment
-    row_ind, col_ind = linear_sum_assignment(cost_matrix)
+    return min_assignment_cost(cost_matrix)
+
+def min_assignment_cost(cost_matrix: List[List[float]]) -> float:
+    """
+    Minimal total cost of assigning every row to a distinct column.
+    Infinite entries (a box that can never reach a target) are allowed: the result is inf
+    when no assignment avoids them.
+    """
+    finite_matrix = [[cost if cost != inf else UNREACHABLE for cost in row] for row in cost_matrix]
+    row_ind, col_ind = linear_sum_assignment(finite_matrix)
     total_cost = 0.0
     for i, j in zip(row_ind, col_ind):
-        # Only sum assignments for existing boxes
-        if i < number_of_boxes and j < number_of_targets:
-            total_cost += cost_matrix[i][j]
-    return total_cost
+        total_cost += finite_matrix[i][j]
+    return inf if total_cost >= UNREACHABLE else total_cost
     
-def ida_star_heuristic(map: Map, deadlocks) -> float:
-    min_distance = hungarian_assignment(map)
+def ida_star_heuristic(map: State, deadlocks, cache: Optional[HeuristicCache] = None) -> float:
+    min_distance = hungarian_assignment(map, deadlocks, cache)
 
-    deadlock_checkers = configure_deadlocks(map, deadlocks)
-
-    if deadlock_checkers:
-        for deadlock_checker in deadlock_checkers:
-            if deadlock_checker(map):
-                return inf
+    if compile_deadlocks(map.board, deadlocks).is_deadlock(map):
+        return inf
             
     # If no deadlocks were detected, return the Hungarian algorithm lower bound
     return min_distance
 
-def manhattan_greedy_safe(state: Map, deadlocks):
-    deadlock_checkers = configure_deadlocks(state, deadlocks)
+def manhattan_greedy_safe(state: State, deadlocks, cache: Optional[HeuristicCache] = None):
+    # Depends on the boxes only, so the whole value can be cached
+    return box_cost(state, cache, lambda boxes_state: greedy_manhattan_cost(boxes_state, deadlocks))
 
-    if deadlock_checkers:
-        for deadlock_checker in deadlock_checkers:
-            if deadlock_checker(state):
-                return inf
+def greedy_manhattan_cost(state: State, deadlocks):
+    if compile_deadlocks(state.board, deadlocks).is_deadlock(state):
+        return inf
             
-    boxes = [(box[0], box[1]) for box in state.positions_of_boxes.keys()]
-    targets = state.targets
+    board = state.board
+    distances = board.manhattan_distances
 
     total = 0
     used_targets = set()
 
-    for box in boxes:
-        if is_simple_corner_deadlock(box, state):
+    # greedy picks depend on the order, sorted keeps the value a function of the set of boxes
+    for box in sorted(state.boxes):
+        if is_simple_corner_deadlock(board.coords[box], state):
             return math.inf
 
         best_dist = float('inf')
         best_target = None
         
-        for target in targets:
+        for target, target_distances in enumerate(distances):
             if target in used_targets:
                 continue
-            dist = abs(box[0] - target[0]) + abs(box[1] - target[1])
+            dist = target_distances[box]
             if dist < best_dist:
                 best_dist = dist
                 best_target = target
@@ -171,183 +222,97 @@ def manhattan_greedy_safe(state: Map, deadlocks):
 
     return total
 
-def exact_matching_cost(map: Map, deadlocks) -> float:
-    deadlock_checkers = configure_deadlocks(map, deadlocks)
+def exact_matching_cost(map: State, deadlocks, cache: Optional[HeuristicCache] = None) -> float:
+    total_box_dist = box_cost(map, cache, lambda state: matching_box_cost(state, deadlocks))
+    if total_box_dist == inf:
+        return inf
+
+    # player → nearest box still to move, computed fresh since it depends on the player
+    board = map.board
+    pd = 0
+    boxes_to_move = [board.coords[box] for box in map.boxes if not board.is_target[box]]
+    if boxes_to_move:
+        px, py = map.player_position
+        pd = min(abs(px - bx) + abs(py - by) for bx,by in boxes_to_move)
+
+    return total_box_dist + 0.5 * pd
 
-    if deadlock_checkers:
-        for deadlock_checker in deadlock_checkers:
-            if deadlock_checker(map):
-                return inf
+def matching_box_cost(map: State, deadlocks) -> float:
+    """Box part of exact_matching_cost: deadlock checks and the optimal box→free target matching."""
+    if compile_deadlocks(map.board, deadlocks).is_deadlock(map):
+        return inf
             
-    box_positions = [(b.x, b.y) for b in map.boxes.values()]
-    target_positions = map.targets
+    board = map.board
+    # box-move distances from every cell to every target, precomputed per level
+    distances = board.box_distances
     # 2) filter out already-solved boxes & targets
-    boxes_to_move = [pos for pos in box_positions if pos not in target_positions]
-    free_targets  = [pos for pos in target_positions if pos not in box_positions]
+    boxes_to_move = [cell for cell in map.boxes if not board.is_target[cell]]
+    free_targets  = [target for target, cell in enumerate(board.target_cell_list) if cell not in map.boxes]
     # 3) exact matching cost
     total_box_dist = 0
     n = len(boxes_to_move)
-    if n > 0:
-        # for small n (≤ 6) brute-force the n! permutations
-        best = inf
-        for perm in itertools.permutations(free_targets, n):
-            s = sum(abs(bx - tx) + abs(by - ty)
-                    for (bx,by), (tx,ty) in zip(boxes_to_move, perm))
-            if s < best:
-                best = s
-        total_box_dist = best
-
-    # 4) player → nearest box
-    pd = 0
-    if boxes_to_move:
-        px, py = map.player.x, map.player.y
-        pd = min(abs(px - bx) + abs(py - by) for bx,by in boxes_to_move)
+    if 0 < n <= MAX_ENUMERATED_BOXES:
+        total_box_dist = min((sum(distances[target][box] for box, target in zip(boxes_to_move, perm))
+                              for perm in itertools.permutations(free_targets, n)), default=inf)
+    elif n > MAX_ENUMERATED_BOXES:
+        # polynomial min-cost assignment, repaired in place when a single box moved since the last call
+        matching = _matchings.get(board)
+        if matching is None:
+            matching = _matchings[board] = IncrementalAssignment()
+        total_box_dist = matching.assign(boxes_to_move, free_targets,
+                                         lambda box: [distances[target][box] for target in free_targets])
+
+    return total_box_dist
+
+def pattern_database_heuristic(map: State, deadlocks, cache: Optional[HeuristicCache] = None) -> float:
+    """
+    Additive pattern database bound: the boxes are split into disjoint groups whose exact costs,
+    solved offline and memory-mapped, are summed. Admissible for both move and push counts.
+    Groups pick their targets independently of each other, so the bound is combined with the
+    box→target assignment bound, which is admissible as well.
+    """
+    return box_cost(map, cache, lambda state: pattern_box_cost(state, deadlocks))
 
-    # 5) combine
-    return total_box_dist + 0.5 * pd
+def pattern_box_cost(map: State, deadlocks) -> float:
+    if compile_deadlocks(map.board, deadlocks).is_deadlock(map):
+        return inf
+
+    return max(pattern_database_for(map.board).cost(map.boxes), box_assignment_cost(map))
 
 ###################################### DEADLOCKS ######################################
 
-def is_simple_corner_deadlock(box, state: Map) -> bool:
+def is_simple_corner_deadlock(box, state: State) -> bool:
     x, y = box
-    walls = state.obstacles
+    walls = state.board.walls
     # Dacă e prins într-un colț și nu e target
     if ((x-1, y) in walls and (x, y-1) in walls) or \
        ((x-1, y) in walls and (x, y+1) in walls) or \
        ((x+1, y) in walls and (x, y-1) in walls) or \
        ((x+1, y) in walls and (x, y+1) in walls):
-        if (x, y) not in state.targets:
+        if (x, y) not in state.board.targets:
             return True
     return False
 
-def is_static_deadlock(m:Map) -> bool:
-  return any(pos in m.dead_squares for pos in m.positions_of_boxes)
+def is_static_deadlock(m: State) -> bool:
+    """A box off target on a square it can never be pushed to a target from"""
+    return compile_deadlocks(m.board, ('static',)).is_deadlock_full(m)
 
-def is_corner_deadlock(m: Map) -> bool:
-    obstacles = set(m.obstacles)
-    targets   = set(m.targets)
-    
-    for (x,y) in set(m.positions_of_boxes) - targets:
-        # check each of the four corner‐orientations
-        left  = ((x-1,y) in obstacles) or x-1 < 0
-        right = ((x+1,y) in obstacles) or x+1 >= m.length
-        up    = ((x,y-1) in obstacles) or y-1 < 0
-        down  = ((x,y+1) in obstacles) or y+1 >= m.width
-
-        # a true corner is exactly one horizontal + one vertical block
-        if (left or right) and (up or down):
-            # print("Corner deadlock at", (x,y))
-            return True
+def is_corner_deadlock(m: State) -> bool:
+    """A box off target blocked along both axes by walls or the border of the map"""
+    return compile_deadlocks(m.board, ('corner',)).is_deadlock_full(m)
 
-    return False
+def is_tunnel_deadlock(map: State) -> bool:
+    """A box off target inside a tunnel, closed at both ends, that holds no target"""
+    return compile_deadlocks(map.board, ('tunnel',)).is_deadlock_full(map)
 
-def is_tunnel_deadlock(map: Map) -> bool:
-    width, length = map.width, map.length
-    obstacles: Set[Tuple[int, int]] = set(map.obstacles)
-    targets: Set[Tuple[int, int]] = set(map.targets)
-    boxes: Set[Tuple[int, int]] = set(map.positions_of_boxes.keys())
-
-    for box_pos in boxes:
-        x, y = box_pos
-        
-        # Skip if box is on a target
-        if box_pos in targets:
-            continue
-        
-        # Check for horizontal tunnel
-        if (0 <= x - 1 < length and 0 <= x + 1 < length and 
-            (x-1, y) in obstacles and (x+1, y) in obstacles):
-            
-            # Box is in horizontal tunnel, check if there's a target in this tunnel
-            tunnel_has_target = False
-            # Check tunnel to the left
-            tx = x
-            while 0 <= tx < length and (tx, y) not in obstacles:
-                if (tx, y) in targets:
-                    tunnel_has_target = True
-                    break
-                tx -= 1
-            
-            # Check tunnel to the right
-            if not tunnel_has_target:
-                tx = x
-                while 0 <= tx < length and (tx, y) not in obstacles:
-                    if (tx, y) in targets:
-                        tunnel_has_target = True
-                        break
-                    tx += 1
-            
-            if not tunnel_has_target:
-                print("Tunnel deadlock")
-                return True  # Tunnel deadlock detected
-            
-    return False
+def is_edge_deadlock(map: State) -> bool:
+    """A box off target on the border of the map, with no target on that border"""
+    return compile_deadlocks(map.board, ('edge',)).is_deadlock_full(map)
 
-def is_edge_deadlock(map: Map) -> bool:
-    width, length = map.width, map.length
-    targets: Set[Tuple[int, int]] = set(map.targets)
-    boxes: Set[Tuple[int, int]] = set(map.positions_of_boxes.keys())
-
-    for box_pos in boxes:
-        x, y = box_pos
-        
-        # Skip if box is on a target
-        if box_pos in targets:
-            continue
-            
-        # Check if box is against an edge and not aligned with any target
-        if x == 0 or x == length - 1 or y == 0 or y == width - 1:
-            # Box is on an edge, check if there's any target on the same edge
-            aligned_with_target = False
-            
-            if x == 0 or x == length - 1:
-                # Box is on horizontal edge
-                for tx, ty in targets:
-                    if tx == x:  # Target is on the same horizontal edge
-                        aligned_with_target = True
-                        break
-            
-            if y == 0 or y == width - 1:
-                # Box is on vertical edge
-                for tx, ty in targets:
-                    if ty == y:  # Target is on the same vertical edge
-                        aligned_with_target = True
-                        break
-            
-            if not aligned_with_target:
-                print("Edge deadlock")
-                return True
-            
-    return False
-
-def is_2x2_deadlock(map: Map) -> bool:
-    targets: Set[Tuple[int, int]] = set(map.targets)
-    boxes: Set[Tuple[int, int]] = set(map.positions_of_boxes.keys())
-
-    for box_pos in boxes:
-        x, y = box_pos
-
-        if box_pos in targets:
-            continue
-
-        square = [(x, y), (x + 1, y), (x, y + 1), (x + 1, y + 1)]
-
-        if all(pos in boxes and not pos in targets for pos in square):
-            print("Square deadlock")
-            return True
-        
-    return False
+def is_2x2_deadlock(map: State) -> bool:
+    """Four boxes off target forming a 2x2 square"""
+    return compile_deadlocks(map.board, ('2x2',)).is_deadlock_full(map)
 
-def configure_deadlocks(map: Map, deadlocks):
-    deadlock_checker = []
-    for deadlock in deadlocks:
-        if deadlock == 'corner':
-            deadlock_checker.append(is_corner_deadlock)
-        elif deadlock == 'tunnel':
-            deadlock_checker.append(is_tunnel_deadlock)
-        elif deadlock == 'edge':
-            deadlock_checker.append(is_edge_deadlock)
-        elif deadlock == '2x2':
-            deadlock_checker.append(is_2x2_deadlock)
-
-    return deadlock_checker
\ No newline at end of file
+def is_freeze_deadlock(map: State) -> bool:
+    """Boxes frozen against walls, dead squares and each other, with at least one of them off target"""
+    return compile_deadlocks(map.board, ('freeze',)).is_deadlock_full(map)
@@ -1,114 +1,336 @@
-from search_methods.solver import Solver
+from search_methods.solver import Solver, BudgetExhausted, SOLVED, TIMEOUT, UNSOLVABLE, EXHAUSTED
+from search_methods.heuristics import DEFAULT_CACHE_ENTRIES
+from search_methods.deadlock_db import DeadlockDatabase
+from search_methods.transposition import TranspositionTable, DEFAULT_TABLE_ENTRIES
 from sokoban.map import Map
+from sokoban.state import State
 
-from typing import List, Set, Union, Dict
-from collections import defaultdict
+from typing import Callable, List, Optional, Tuple, Union, Dict
 import math
 
+# Expansions between two calls of the poll hook
+POLL_INTERVAL = 1024
+
+# States kept waiting for the component they belong to to be proven dead, over one iteration
+MAX_PENDING_STATES = 1 << 18
+
 class IDAStarSolver(Solver):
     def __init__(self, 
                  map: Map,
                  heuristic,
                  deadlocks,
-                 max_depth: int = 100, 
-                 debug: bool = False
+                 max_depth: Optional[int] = None,
+                 debug: bool = False,
+                 push_level: bool = False,
+                 cache_size: int = DEFAULT_CACHE_ENTRIES,
+                 deadlock_db: Optional[str] = None,
+                 tt_size: int = DEFAULT_TABLE_ENTRIES,
+                 deadline: Optional[float] = None,
+                 max_nodes: Optional[int] = None
                  ) -> None:
-        super().__init__(map)
+        super().__init__(map, push_level, cache_size, deadline, max_nodes)
         self.heuristic = heuristic
         self.path = []
         self.visited = set()
         self.nodes_expanded = 0
+        # Expansions of the iterations before the current one, nodes_expanded restarts at every iteration
+        self.expanded_before = 0
+        # Smallest heuristic reached and the moves that reached it, the partial result of an unfinished solve
+        self.best_h = math.inf
+        self.best_path: List[Union[int, Tuple[int, int]]] = []
         self.max_depth = max_depth
         self.debug = debug
         self.deadlocks = deadlocks
 
-    def solve(self) -> Union[List[int], None]:
-        threshold = self.heuristic(self.map, self.deadlocks)
+        # Positions proven dead, loaded from and saved to the file when a path is given
+        self.deadlock_db = DeadlockDatabase(deadlock_db, map.board, heuristic.__name__, deadlocks)
+        # Cuts that keep a subtree from being proven dead: transpositions and the depth limit,
+        # and the smallest discovery index a cycle went back to
+        self.open_cuts = 0
+        self.lowest_cycle = math.inf
+        # Dead proofs work on the strongly connected components of the states searched, as every pull
+        # can be undone by a push: each expanded state gets a discovery index, and the states left while
+        # cycles from them still lead above stay pending, with their index, until the component is resolved
+        self.discovered = 0
+        self.pending: Dict[int, int] = {}
+        self.component: List[int] = []
+
+        # States reached and the bounds learned on them, kept over all threshold iterations.
+        # States known dead, deadlocks found by the heuristic and proven positions, get an infinite bound
+        self.table = TranspositionTable(tt_size)
+        self.iteration = 0
+        # Smallest f over the threshold of the states cut off in this iteration, by their heuristic or by
+        # a bound from an earlier iteration, and the number of such cuts. Transposition cuts and cycles lead
+        # to no state of their own, so they never raise the threshold: once nothing else is left, every
+        # reachable state was searched. Bounds are only kept for subtrees with a cut of that kind below
+        self.next_threshold = math.inf
+        self.frontier_cuts = 0
+
+        # Called with the stack and the path every poll_interval expansions, e.g. by parallel workers
+        # to stop or to give away moves; frames up to incomplete_depth then lose part of their subtree
+        self.poll: Optional[Callable[[List[list], list], None]] = None
+        self.poll_interval = POLL_INTERVAL
+        self.incomplete_depth = -1
 
-        self.path: List[Map] = [self.map.copy()]
+    def solve(self) -> Union[List[int], None]:
+        try:
+            return self.run_iterations()
+        finally:
+            self.deadlock_db.save()
 
-        path_dict: Dict[int, int] = {}
+    def run_iterations(self) -> Union[List[int], None]:
+        # The search runs on compact states, the map is only kept for the static board
+        start = State.from_map(self.map)
+        self.start_budget()
+        self.expanded_before = 0
+        self.best_h = math.inf
+        self.best_path = []
+        threshold = self.heuristic(start, self.deadlocks, cache=self.heuristic_cache)
+        if threshold == float('inf') or self.deadlock_db.is_dead(start):
+            # Only the start gets a full deadlock check, its successors are checked around the box moved
+            self.finish(UNSOLVABLE, [], 0)
+            return None
 
         while True:
-            self.cost_so_far = defaultdict(lambda: math.inf)
-            self.cost_so_far[self._hash(self.map)] = 0
+            self.iteration += 1
+            self.table.store(self._hash(start), 0, 0, self.iteration)
 
             self.nodes_expanded = 0
-            result = self.search(self.map.copy(), path_dict, 0, threshold, set())
+            self.next_threshold = math.inf
+            # A single state is explored in place, moves are undone when backtracking
+            try:
+                result = self.search(start.copy(), threshold)
+            except BudgetExhausted:
+                self.finish(TIMEOUT, self.expand_moves(start, self.best_path),
+                            self.expanded_before + self.nodes_expanded, self.best_h)
+                return None
+            self.expanded_before += self.nodes_expanded
 
             if result == 'FOUND':
+                self.path = self.expand_moves(start, self.path)
+                self.finish(SOLVED, self.path, self.expanded_before, 0)
                 return self.path
-            if result == float('inf'):
+            if self.next_threshold == float('inf'):
+                # With a depth limit, the cuts at the limit also leave no state over the threshold
+                status = UNSOLVABLE if self.max_depth is None else EXHAUSTED
+                if status == UNSOLVABLE:
+                    self.deadlock_db.add(start)
+                self.finish(status, self.expand_moves(start, self.best_path), self.expanded_before, self.best_h)
+                return None
+            # Every solution within the depth limit costs at most the limit
+            if self.max_depth is not None and self.next_threshold > self.max_depth:
+                self.finish(EXHAUSTED, self.expand_moves(start, self.best_path), self.expanded_before, self.best_h)
                 return None
 
-            threshold = result
+            threshold = self.next_threshold
 
-    def search(self, 
-               current_map: Map, 
-               path_dict: Dict[int, int], 
-               g: int, 
-               threshold: int, 
-               path_visited: Set[str]
+    def search_subtree(self, start: State, moves: list, threshold: float) -> Union[float, str]:
+        """Searches the subtree reached by playing the moves from the start, as search does for the root."""
+        current_map = start.copy()
+        path_visited: Dict[int, int] = {}
+        for move in moves:
+            # Above every state of the subtree, so no dead proof escapes it
+            path_visited[self._hash(current_map)] = -1
+            self.make_move(current_map, move)
+        return self.search(current_map, threshold, list(moves), path_visited)
+
+    def search(self,
+               current_map: State,
+               threshold: float,
+               path_moves: Optional[List[Union[int, Tuple[int, int]]]] = None,
+               path_visited: Optional[Dict[int, int]] = None
                ) -> Union[float, str]:
-        self.nodes_expanded += 1
+        """
+        One depth-first iteration bounded by the threshold, run on an explicit stack of frames
+        instead of recursive calls, so the depth is only limited by max_depth.
+        The state is at the end of path_moves, whose earlier states are in path_visited.
 
-        state_key = str(current_map)
-        if state_key in path_visited:
-            return float('inf')
-        path_visited.add(state_key)
+        Each frame is [state key, g, iterator over the remaining moves, undo record of the move that
+        led to the state, smallest f over the threshold found below it, open cuts, lowest cycle and
+        frontier cuts saved when it was entered, its discovery index, length of the component list when
+        it was entered]. Returns 'FOUND' or the smallest f over the threshold, the next threshold being
+        next_threshold. path_visited maps the states on the path to their discovery index.
+        """
+        if path_moves is None:
+            path_moves = []
+        if path_visited is None:
+            path_visited = {}
+        stack: List[list] = []
+        self.pending = {}
+        self.component = []
 
-        try:
-            h = self.heuristic(current_map, self.deadlocks)
-            f = g + h
-
-            if f > threshold:
-                return f
-            
-            if g >= self.max_depth:
-                return float('inf')
-            
-            if current_map.is_solved():
-                self.path = [path_dict[i] for i in range(g)]
-                return 'FOUND'
-            
-            min_cost = float('inf')
-
-            for move in current_map.filter_possible_moves():
-                path_dict[g] = move
-
-                new_map = current_map.copy()
+        result = self.enter(current_map, len(path_moves), threshold, None, stack, path_moves, path_visited)
+        while stack:
+            frame = stack[-1]
+            if result is not None:
+                # Child just searched: the node it came from collects its result
+                if result == 'FOUND':
+                    return 'FOUND'
+                if result < frame[4]:
+                    frame[4] = result
+                result = None
+
+            state_key, g, successors = frame[0], frame[1], frame[2]
+            for move in successors:
                 try:
-                    new_map.apply_move(move)
+                    undo_record = self.make_move(current_map, move)
                 except ValueError as e:
                     if self.debug:
                         print(f"Invalid move {move} attempted: {e}")
-                    del path_dict[g]
                     continue
 
-                hash = self._hash(new_map)
-                if g + 1 >= self.cost_so_far[hash]:
-                    del path_dict[g]
+                hash = self._hash(current_map)
+                slot = self.table.find(hash)
+                if (slot >= 0 and self.table.bounds[slot] == math.inf) or self.deadlock_db.is_dead(current_map):
+                    # Known dead, in this solve or an earlier one
+                    current_map.undo_move(undo_record)
                     continue
-                self.cost_so_far[hash] = g + 1
-                    
-                result = self.search(new_map, path_dict, g + 1, threshold, path_visited)
-                    
-                if result == "FOUND":
-                    return "FOUND"
-                if result < min_cost:
-                    min_cost = result
-                        
-                del path_dict[g]
-
-            return min_cost
-        
-        finally:
-            path_visited.remove(state_key)
 
-    def _hash(self, state: Map) -> tuple:
+                if slot >= 0:
+                    bound = g + 1 + self.table.bounds[slot]
+                    if self.table.iterations[slot] == self.iteration and self.table.depths[slot] <= g + 1:
+                        # Already searched in this iteration from no deeper: no solution within the
+                        # threshold behind it, unless it is on the current path. A state on the path,
+                        # or in a component still open, is a cycle; anything else may lead elsewhere
+                        link = path_visited.get(hash, self.pending.get(hash))
+                        if link is not None:
+                            self.lowest_cycle = min(self.lowest_cycle, link)
+                        else:
+                            self.open_cuts += 1
+                        if hash not in path_visited and max(bound, math.floor(threshold) + 1) < frame[4]:
+                            frame[4] = max(bound, math.floor(threshold) + 1)
+                        current_map.undo_move(undo_record)
+                        continue
+                    if bound > threshold:
+                        # Proven in an earlier iteration to exceed this threshold
+                        if bound < frame[4]:
+                            frame[4] = bound
+                        self.frontier_cuts += 1
+                        if bound < self.next_threshold:
+                            self.next_threshold = bound
+                        current_map.undo_move(undo_record)
+                        continue
+                self.table.store(hash, g + 1, 0, self.iteration, slot)
+
+                path_moves.append(move)
+                result = self.enter(current_map, g + 1, threshold, undo_record, stack, path_moves, path_visited)
+                if result is None:
+                    # The child got a frame of its own, it is searched next
+                    break
+
+                # Cut off as soon as it was reached
+                path_moves.pop()
+                current_map.undo_move(undo_record)
+                if result == 'FOUND':
+                    return 'FOUND'
+                if result < frame[4]:
+                    frame[4] = result
+                result = None
+            else:
+                result = self.leave(current_map, stack, path_moves, path_visited)
+
+        return result
+
+    def enter(self,
+              current_map: State,
+              g: int,
+              threshold: float,
+              undo_record: Optional[tuple],
+              stack: List[list],
+              path_moves: List[Union[int, Tuple[int, int]]],
+              path_visited: Dict[int, int]
+              ) -> Union[float, str, None]:
+        """
+        Reaches a state at depth g. Returns its result when it is cut off or solved,
+        otherwise pushes its frame and returns None.
+        """
+        if self.out_of_budget(self.expanded_before + self.nodes_expanded):
+            raise BudgetExhausted()
+        self.nodes_expanded += 1
+        if self.poll is not None and self.nodes_expanded % self.poll_interval == 0:
+            self.poll(stack, path_moves)
+
+        state_key = self._hash(current_map)
+        if state_key in path_visited:
+            # Only a cycle that stays inside a subtree lets it be proven dead
+            self.lowest_cycle = min(self.lowest_cycle, path_visited[state_key])
+            return float('inf')
+
+        h = self.heuristic(current_map, self.deadlocks, cache=self.heuristic_cache)
+        if h == float('inf'):
+            # Never expanded, whatever the threshold: the deadlock checks of its successors assume it is not dead
+            self.table.raise_bound(state_key, h)
+            return h
+        f = g + h
+        self.table.raise_bound(state_key, h)
+        if h < self.best_h:
+            self.best_h = h
+            self.best_path = list(path_moves)
+
+        if f > threshold:
+            self.frontier_cuts += 1
+            if f < self.next_threshold:
+                self.next_threshold = f
+            return f
+
+        if current_map.is_solved():
+            self.path = list(path_moves)
+            return 'FOUND'
+
+        if self.max_depth is not None and g >= self.max_depth:
+            self.open_cuts += 1
+            return float('inf')
+
+        path_visited[state_key] = self.discovered
+        stack.append([state_key, g, iter(self.successor_moves(current_map)), undo_record,
+                      float('inf'), self.open_cuts, self.lowest_cycle, self.frontier_cuts,
+                      self.discovered, len(self.component)])
+        self.discovered += 1
+        self.lowest_cycle = math.inf
+        return None
+
+    def leave(self,
+              current_map: State,
+              stack: List[list],
+              path_moves: List[Union[int, Tuple[int, int]]],
+              path_visited: Dict[int, int]
+              ) -> float:
+        """Pops the frame whose moves are all searched, backtracks to its parent and returns its result."""
+        (state_key, g, _, undo_record, min_cost, open_cuts, lowest_cycle, frontier_cuts,
+         index, component_start) = stack.pop()
+
+        dead = False
+        if self.lowest_cycle >= index:
+            # No cycle leads above the state: it closes the component of the states left pending below it
+            members = self.component[component_start:]
+            del self.component[component_start:]
+            for key in members:
+                self.pending.pop(key, None)
+            # Searched whole without reaching a state over the threshold or cutting anything off: every
+            # move out of the component leads to a dead state
+            dead = self.open_cuts == open_cuts and self.frontier_cuts == frontier_cuts
+            if dead:
+                for key in members:
+                    self.table.raise_bound(key, math.inf)
+                self.table.raise_bound(state_key, math.inf)
+                self.deadlock_db.add(current_map)
+        elif len(self.pending) < MAX_PENDING_STATES:
+            self.pending[state_key] = index
+            self.component.append(state_key)
+
+        if not dead and min_cost != float('inf') and g > self.incomplete_depth and self.frontier_cuts != frontier_cuts:
+            self.table.raise_bound(state_key, min_cost - g)
+
+        del path_visited[state_key]
+        self.lowest_cycle = min(lowest_cycle, self.lowest_cycle)
+        if undo_record is not None:
+            current_map.undo_move(undo_record)
+            path_moves.pop()
+        return min_cost
+
+    def _hash(self, state: State) -> int:
         """
-        A simple, collision-resistant hash: sorted box positions plus player pos.
+        64-bit Zobrist key of the box positions plus player pos, kept up to date by apply_move.
+        At push level the player is normalized to its reachable region.
         """
-        boxes = tuple(sorted((b.x, b.y) for b in state.boxes.values()))
-        player = (state.player.x, state.player.y)
-        return boxes + (player,)
+        return self.state_key(state)
@@ -0,0 +1,159 @@
+from sokoban.map import Map
+from sokoban.state import State
+
+from typing import Dict, List, Tuple
+import heapq
+import time
+
+# Moves a replacement path may take at most
+DEFAULT_WINDOW = 16
+
+# States a single shortcut search may generate before it settles for the best shortcut found
+DEFAULT_SEARCH_NODES = 4000
+
+
+class SolutionOptimizer:
+    """
+    Post-search stage that shortens the move list of any solver.
+
+    The solution is replayed once and the key of every state along it is recorded, together with the
+    last position the key occurs at. Walking the path from the start, a bounded search from the
+    current state looks for a later state of the path it can reach with fewer moves: a state met
+    again later (a loop) is reached in zero moves, a state a few moves off the path through a
+    shorter route. The path jumps to the best such state, and the walk goes on from there.
+
+    In push-aware mode the searches order paths by (pulls, moves) instead of moves, so a shortcut
+    may be longer than the segment it replaces as long as it pulls fewer boxes, and the number of
+    undo moves of the solution only goes down.
+
+    Both modes keep the start and the end state, so a solution stays a solution.
+    """
+    def __init__(self,
+                 map: Map,
+                 window: int = DEFAULT_WINDOW,
+                 push_aware: bool = False,
+                 search_nodes: int = DEFAULT_SEARCH_NODES) -> None:
+        if window < 1:
+            raise ValueError(f'Optimizer window must allow at least one move, got {window}')
+        self.map = map
+        self.window = window
+        self.push_aware = push_aware
+        self.search_nodes = search_nodes
+
+        self.nodes_expanded = 0
+        self.shortcuts = 0
+        self.original_moves = 0
+        self.original_pulls = 0
+        self.pull_moves = 0
+        self.elapsed = 0.0
+
+    def replay(self, start: State, moves: List[int]) -> List[tuple]:
+        """Undo records of the states along the moves, the start included; raises ValueError on an invalid move."""
+        state = start.copy()
+        records = [(state.player, state.boxes, state.undo_moves, state.key, state.box_mask, state.moved_box)]
+        for move in moves:
+            state.make_move(move)
+            records.append((state.player, state.boxes, state.undo_moves, state.key, state.box_mask, state.moved_box))
+        return records
+
+    def shortcut(self, scratch: State, origin: tuple, index: int, pulls: List[int],
+                 last_index: Dict[int, int]) -> Tuple[int, List[int]]:
+        """
+        Searches from the state of the path at index for the later state of the path that saves the most,
+        returning its index and the moves that lead to it, (index, []) when nothing beats the path.
+        """
+        push_aware = self.push_aware
+        window = self.window
+        # Cost of the path between two of its states, compared as tuples
+        base_pulls = pulls[index]
+
+        def path_cost(target: int) -> tuple:
+            if push_aware:
+                return (pulls[target] - base_pulls, target - index)
+            return (target - index,)
+
+        zero = (0, 0) if push_aware else (0,)
+        best_index = index
+        best_key = origin[3]
+        best_saving = zero
+        parents = {origin[3]: None}
+        # Cost of the route found so far to each key, as (pulls, moves) or (moves,)
+        costs = {origin[3]: zero}
+        heap = [(costs[origin[3]], 0, origin)]
+        sequence = 0
+        generated = 0
+
+        while heap and generated < self.search_nodes:
+            cost, _, record = heapq.heappop(heap)
+            key = record[3]
+            if cost > costs[key]:
+                continue
+
+            target = last_index.get(key, -1)
+            if target > index:
+                saving = tuple(a - b for a, b in zip(path_cost(target), cost))
+                if saving > best_saving:
+                    best_index, best_key, best_saving = target, key, saving
+
+            if cost[-1] >= window:
+                continue
+
+            scratch.undo_move(record)
+            for move in scratch.filter_possible_moves():
+                undo_record = scratch.make_move(move)
+                child_key = scratch.key
+                child_cost = (cost[0] + scratch.undo_moves - record[2], cost[1] + 1) if push_aware else (cost[0] + 1,)
+                if child_key not in costs or child_cost < costs[child_key]:
+                    costs[child_key] = child_cost
+                    parents[child_key] = (key, move)
+                    sequence += 1
+                    heapq.heappush(heap, (child_cost, sequence,
+                                          (scratch.player, scratch.boxes, scratch.undo_moves, child_key,
+                                           scratch.box_mask, scratch.moved_box)))
+                    generated += 1
+                scratch.undo_move(undo_record)
+
+        self.nodes_expanded += generated
+        if best_index == index:
+            return index, []
+
+        # Walk the parents back from the state of the path the search reached
+        moves = []
+        key = best_key
+        while parents[key] is not None:
+            key, move = parents[key]
+            moves.append(move)
+        moves.reverse()
+        return best_index, moves
+
+    def optimize(self, moves: List[int]) -> List[int]:
+        """Returns a solution reaching the same final state as the moves in fewer moves, or fewer pulls in push-aware mode."""
+        started = time.perf_counter()
+        start = State.from_map(self.map)
+        records = self.replay(start, moves)
+        pulls = [record[2] for record in records]
+        # A key the path meets again later jumps straight to its last occurrence
+        last_index = {record[3]: position for position, record in enumerate(records)}
+
+        self.original_moves = len(moves)
+        self.original_pulls = pulls[-1] - pulls[0]
+        self.nodes_expanded = 0
+        self.shortcuts = 0
+
+        scratch = start.copy()
+        optimized = []
+        index = 0
+        while index < len(moves):
+            target, route = self.shortcut(scratch, records[index], index, pulls, last_index)
+            if target == index:
+                optimized.append(moves[index])
+                index += 1
+            else:
+                optimized.extend(route)
+                self.shortcuts += 1
+                index = target
+
+        # Replaying the new solution checks it and counts its pulls
+        self.pull_moves = self.replay(start, optimized)[-1][2] - start.undo_moves
+        self.elapsed = time.perf_counter() - started
+        return optimized
@@ -0,0 +1,149 @@
+from search_methods.simulated_annealing import SimulatedAnnealingSolver, ADAPTIVE_WINDOW, DEFAULT_PATIENCE, DEFAULT_TABU_TENURE
+from search_methods.heuristics import DEFAULT_CACHE_ENTRIES
+from search_methods.solver import Solver, SOLVED, TIMEOUT
+from sokoban.map import Map
+
+from typing import List, Optional, Sequence
+import multiprocessing
+import numpy as np
+import os
+
+# Cancel event of the chains running in a pool process, set by init_chain
+_cancel_event = None
+
+class ParallelAnnealingSolver(Solver):
+    """
+    Independent simulated annealing chains spread over a process pool.
+
+    Chain i gets its own seed, spawned from the base seed, and cycles through the given initial
+    temperatures and alphas, so a run is reproducible from the base seed alone. The first chain to
+    solve the level sets a shared event that makes the others stop; if none solves it, the chain
+    whose best state has the smallest heuristic (then the shortest path to it) is kept, and its path
+    is the partial result. The deadline is that of the whole solve: every chain stops at the same
+    clock time, even one that waited in the pool for a free process. The node limit applies to
+    every chain on its own.
+    The stats of every chain, seed included, are kept in chains.
+    """
+    def __init__(self,
+                 map: Map,
+                 heuristic,
+                 deadlocks,
+                 chains: int = 0,
+                 seed: Optional[int] = None,
+                 initial_temps: Sequence[float] = (1000,),
+                 alphas: Sequence[float] = (0.01,),
+                 decay_rate: float = 0.000003,
+                 min_temp: float = 1,
+                 push_level: bool = False,
+                 cache_size: int = DEFAULT_CACHE_ENTRIES,
+                 adaptive: bool = False,
+                 window: int = ADAPTIVE_WINDOW,
+                 patience: Optional[int] = DEFAULT_PATIENCE,
+                 tabu_tenure: int = DEFAULT_TABU_TENURE,
+                 deadline: Optional[float] = None,
+                 max_nodes: Optional[int] = None) -> None:
+        if not initial_temps or not alphas:
+            raise ValueError('Parallel annealing needs at least one initial temperature and one alpha')
+        # The chains keep their own heuristic caches
+        super().__init__(map, push_level, 0, deadline, max_nodes)
+        self.heuristic = heuristic
+        self.deadlocks = deadlocks
+        self.chain_count = chains if chains > 0 else os.cpu_count()
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.initial_temps = list(initial_temps)
+        self.alphas = list(alphas)
+        self.options = {
+            'decay_rate': decay_rate,
+            'min_temp': min_temp,
+            'push_level': push_level,
+            'cache_size': cache_size,
+            'adaptive': adaptive,
+            'window': window,
+            'patience': patience,
+            'tabu_tenure': tabu_tenure,
+            'max_nodes': max_nodes,
+        }
+
+        self.chains: List[dict] = []
+        self.best_chain: Optional[dict] = None
+        self.nodes_expanded = 0
+        self.pull_moves = 0
+        self.move_path: List[int] = []
+
+    def chain_configs(self) -> List[dict]:
+        """Seed, initial temperature and alpha of every chain."""
+        seeds = np.random.SeedSequence(self.seed).spawn(self.chain_count)
+        return [
+            {
+                'chain': i,
+                'seed': int(seeds[i].generate_state(1, np.uint64)[0]),
+                'initial_temp': self.initial_temps[i % len(self.initial_temps)],
+                'alpha': self.alphas[i % len(self.alphas)],
+            }
+            for i in range(self.chain_count)
+        ]
+
+    @property
+    def cache_hits(self) -> int:
+        return sum(chain['cache_hits'] for chain in self.chains)
+
+    @property
+    def cache_misses(self) -> int:
+        return sum(chain['cache_misses'] for chain in self.chains)
+
+    def solve(self) -> Optional[List[int]]:
+        self.start_budget()
+        context = multiprocessing.get_context()
+        cancel = context.Event()
+        jobs = [(self.map, self.heuristic, self.deadlocks, self.options, config, self.stop_time)
+                for config in self.chain_configs()]
+
+        self.chains = []
+        self.best_chain = None
+        with context.Pool(min(self.chain_count, os.cpu_count()), initializer=init_chain, initargs=(cancel,)) as pool:
+            for chain in pool.imap_unordered(run_chain, jobs):
+                self.chains.append(chain)
+                if chain['solved'] and self.best_chain is None:
+                    self.best_chain = chain
+                    cancel.set()
+
+        self.chains.sort(key=lambda chain: chain['chain'])
+        if self.best_chain is None:
+            self.best_chain = min(self.chains, key=lambda chain: (chain['best_h'], len(chain['move_path'])))
+
+        self.move_path = self.best_chain.pop('move_path')
+        for chain in self.chains:
+            chain.pop('move_path', None)
+        self.nodes_expanded = sum(chain['nodes_expanded'] for chain in self.chains)
+        self.pull_moves = self.best_chain['pull_moves']
+
+        status = self.best_chain['status']
+        # Chains stopped by the solved one did not run out of anything themselves
+        if status != SOLVED and any(chain['status'] == TIMEOUT for chain in self.chains):
+            status = TIMEOUT
+        self.finish(status, self.move_path, self.nodes_expanded, self.best_chain['best_h'])
+        return self.move_path if status == SOLVED else None
+
+def init_chain(cancel) -> None:
+    """Pool initializer: keeps the cancel event for the chains run in this process."""
+    global _cancel_event
+    _cancel_event = cancel
+
+def run_chain(job: tuple) -> dict:
+    """Runs one chain in a pool process, returning its stats along with its moves."""
+    map, heuristic, deadlocks, options, config, stop_time = job
+    solver = SimulatedAnnealingSolver(map, heuristic, deadlocks, initial_temp=config['initial_temp'],
+                                      seed=config['seed'], alpha=config['alpha'], **options)
+    solver.cancel_event = _cancel_event
+    solver.outer_stop_time = stop_time
+    # The solution, or the path to the best state the chain reached
+    move_path = solver.run().moves
+    return {
+        'chain': config['chain'],
+        **solver.stats,
+        'status': solver.result.status,
+        'pull_moves': solver.pull_moves,
+        'cache_hits': solver.cache_hits,
+        'cache_misses': solver.cache_misses,
+        'move_path': move_path,
+    }
@@ -0,0 +1,336 @@
+from search_methods.ida_star import IDAStarSolver
+from search_methods.heuristics import DEFAULT_CACHE_ENTRIES
+from search_methods.solver import SOLVED, TIMEOUT, UNSOLVABLE, EXHAUSTED
+from search_methods.transposition import DEFAULT_TABLE_ENTRIES
+from sokoban.map import Map
+from sokoban.state import State
+
+from typing import List, Optional, Tuple, Union
+import math
+import multiprocessing
+import os
+import queue
+
+# Depth of the root tree the main process expands into the first subtrees
+DEFAULT_SPLIT_DEPTH = 2
+
+# Seconds the main process waits for a result before it checks the deadline and the workers
+RESULT_WAIT = 0.05
+
+# Seconds a worker gets to exit once the solve is over, before it is terminated
+JOIN_TIMEOUT = 1.0
+
+class SearchAborted(Exception):
+    """Raised inside a worker to abandon its subtree once a solution was found elsewhere or the budget ran out"""
+
+class SharedSearch:
+    """
+    Values shared by the main process and the workers: the iteration and threshold being searched,
+    the number of subtrees handed out in this iteration, the number of idle workers, the nodes
+    expanded over the whole solve with the limit on them, and the signal to drop the subtrees,
+    set once a solution was found or the budget of the solve ran out.
+    """
+    def __init__(self, context, max_nodes: Optional[int] = None) -> None:
+        self.iteration = context.Value('l', 0)
+        self.threshold = context.Value('d', 0.0)
+        self.created = context.Value('l', 0)
+        self.idle = context.Value('l', 0)
+        self.nodes = context.Value('q', 0)
+        self.max_nodes = max_nodes
+        self.stop = context.Event()
+
+class ParallelIDAStarSolver(IDAStarSolver):
+    """
+    IDA* spread over worker processes. Each iteration, the main process expands the root to
+    split_depth and hands the subtrees below it to the workers through a queue; each worker runs
+    the sequential search on its subtrees, with its own transposition table kept for the whole solve.
+
+    While some worker is idle and the queue is empty, busy workers give away the untried moves of
+    their shallowest frame as new subtrees. The iteration ends when every subtree handed out has
+    reported back; the next threshold is the smallest f over all of them. A worker finding a solution
+    sets the shared signal, and the others drop their subtrees. Every solution of an iteration costs
+    exactly its threshold, so the length matches the sequential solver's.
+
+    The workers load the deadlock database too and send the positions they prove dead with their
+    results; the main process merges them into its own database, saved at the end of the solve.
+
+    The deadline of the solve is watched by the main process while it waits for the workers, the
+    node limit by everyone through the shared count of expanded nodes, which the workers add to at
+    each poll, made on every expansion under a node limit. Once the budget runs out, the same signal
+    is set and the best partial path the workers reported is kept. A solution found past the node
+    limit is not kept. A worker that dies would never report back, so the solve stops with a
+    RuntimeError instead of waiting.
+    """
+    def __init__(self,
+                 map: Map,
+                 heuristic,
+                 deadlocks,
+                 workers: int = 0,
+                 split_depth: int = DEFAULT_SPLIT_DEPTH,
+                 max_depth: Optional[int] = None,
+                 debug: bool = False,
+                 push_level: bool = False,
+                 cache_size: int = DEFAULT_CACHE_ENTRIES,
+                 deadlock_db: Optional[str] = None,
+                 tt_size: int = DEFAULT_TABLE_ENTRIES,
+                 deadline: Optional[float] = None,
+                 max_nodes: Optional[int] = None
+                 ) -> None:
+        super().__init__(map, heuristic, deadlocks, max_depth, debug, push_level, cache_size, deadlock_db, tt_size,
+                         deadline, max_nodes)
+        self.workers = workers if workers > 0 else os.cpu_count()
+        self.split_depth = split_depth
+        # Options the workers build their own sequential solver with
+        self.options = {
+            'max_depth': max_depth,
+            'push_level': push_level,
+            'cache_size': cache_size,
+            'tt_size': tt_size,
+            'deadlock_db': deadlock_db,
+        }
+
+    def run_iterations(self) -> Union[List[int], None]:
+        start = State.from_map(self.map)
+        self.start_budget()
+        self.expanded_before = 0
+        self.best_h = math.inf
+        self.best_path = []
+        threshold = self.heuristic(start, self.deadlocks, cache=self.heuristic_cache)
+        if threshold == math.inf or self.deadlock_db.is_dead(start):
+            self.finish(UNSOLVABLE, [], 0)
+            return None
+
+        context = multiprocessing.get_context()
+        shared = SharedSearch(context, self.max_nodes)
+        tasks = context.Queue()
+        results = context.Queue()
+        processes = [
+            context.Process(target=run_worker, daemon=True,
+                            args=(self.map, self.heuristic, self.deadlocks, self.options, tasks, results, shared))
+            for _ in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            while True:
+                if threshold == math.inf:
+                    status = UNSOLVABLE if self.max_depth is None else EXHAUSTED
+                    if status == UNSOLVABLE:
+                        self.deadlock_db.add(start)
+                    self.finish(status, self.expand_moves(start, self.best_path), self.expanded_before, self.best_h)
+                    return None
+
+                self.iteration += 1
+                shared.iteration.value = self.iteration
+                shared.threshold.value = threshold
+                self.nodes_expanded = 0
+                timed_out = False
+
+                subtrees, min_cost, solution = self.split_root(start, threshold)
+                with shared.nodes.get_lock():
+                    shared.nodes.value += self.nodes_expanded
+                if solution is None and self.over_node_limit(shared.nodes.value):
+                    timed_out = True
+                elif solution is None:
+                    with shared.created.get_lock():
+                        shared.created.value = len(subtrees)
+                    for moves in subtrees:
+                        tasks.put(moves)
+
+                    # Workers add to created before they give subtrees away, so it is final once reached
+                    received = 0
+                    while received < shared.created.value:
+                        try:
+                            message = results.get(timeout=RESULT_WAIT)
+                        except queue.Empty:
+                            # A worker that died never reports back on the subtrees it took
+                            for process in processes:
+                                if not process.is_alive():
+                                    shared.stop.set()
+                                    raise RuntimeError(f'IDA* worker {process.pid} exited with code {process.exitcode}')
+                            if not timed_out and (self.over_node_limit(shared.nodes.value) or self.past_deadline()):
+                                # Out of budget: the workers drop their subtrees and still report back
+                                timed_out = True
+                                shared.stop.set()
+                            continue
+                        received += 1
+                        self.nodes_expanded += message[1]
+                        self.deadlock_db.merge(*message[5])
+                        if message[3] < self.best_h:
+                            self.best_h, self.best_path = message[3], message[4]
+                        if message[0] == 'found' and solution is None:
+                            solution = message[2]
+                            shared.stop.set()
+                        elif message[0] == 'bound' and message[2] < min_cost:
+                            min_cost = message[2]
+                        if not timed_out and (self.over_node_limit(shared.nodes.value) or self.past_deadline()):
+                            timed_out = True
+                            shared.stop.set()
+                self.expanded_before += self.nodes_expanded
+
+                # A worker stops everyone once the node limit is reached, and a solution expanded past it is dropped
+                if solution is None and shared.stop.is_set():
+                    timed_out = True
+                if solution is not None and self.max_nodes is not None and self.expanded_before > self.max_nodes:
+                    solution = None
+                    timed_out = True
+
+                if solution is not None:
+                    self.path = self.expand_moves(start, solution)
+                    self.finish(SOLVED, self.path, self.expanded_before, 0)
+                    return self.path
+                if timed_out:
+                    self.finish(TIMEOUT, self.expand_moves(start, self.best_path), self.expanded_before, self.best_h)
+                    return None
+
+                # Every solution within the depth limit costs at most the limit
+                if self.max_depth is not None and min_cost > self.max_depth:
+                    self.finish(EXHAUSTED, self.expand_moves(start, self.best_path), self.expanded_before, self.best_h)
+                    return None
+                threshold = min_cost
+        finally:
+            for _ in processes:
+                tasks.put(None)
+            for process in processes:
+                process.join(JOIN_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+
+    def split_root(self, start: State, threshold: float) -> Tuple[List[list], float, Optional[list]]:
+        """
+        Expands the root down to split_depth within the threshold. Returns the move lists of the
+        subtrees to search, the smallest f over the threshold met on the way, and the moves of a
+        solution if one is that shallow.
+        """
+        subtrees = []
+        min_cost = math.inf
+        moves = []
+        path = {self._hash(start)}
+        current_map = start.copy()
+        # Frames of (iterator over the remaining moves, undo record of the move that led to the state)
+        stack = [(iter(self.successor_moves(current_map)), None)]
+        self.nodes_expanded += 1
+
+        if current_map.is_solved():
+            return subtrees, min_cost, moves
+
+        while stack:
+            successors, _ = stack[-1]
+            for move in successors:
+                try:
+                    undo_record = self.make_move(current_map, move)
+                except ValueError:
+                    continue
+
+                key = self._hash(current_map)
+                if key in path or self.deadlock_db.is_dead(current_map):
+                    current_map.undo_move(undo_record)
+                    continue
+
+                f = len(moves) + 1 + self.heuristic(current_map, self.deadlocks, cache=self.heuristic_cache)
+                if f > threshold:
+                    min_cost = min(min_cost, f)
+                    current_map.undo_move(undo_record)
+                    continue
+
+                moves.append(move)
+                if current_map.is_solved():
+                    return subtrees, min_cost, list(moves)
+                if len(moves) == self.split_depth or (self.max_depth is not None and len(moves) >= self.max_depth):
+                    subtrees.append(list(moves))
+                    moves.pop()
+                    current_map.undo_move(undo_record)
+                    continue
+
+                self.nodes_expanded += 1
+                path.add(key)
+                stack.append((iter(self.successor_moves(current_map)), undo_record))
+                break
+            else:
+                _, undo_record = stack.pop()
+                if undo_record is not None:
+                    path.discard(self._hash(current_map))
+                    current_map.undo_move(undo_record)
+                    moves.pop()
+
+        return subtrees, min_cost, None
+
+def run_worker(map: Map, heuristic, deadlocks, options: dict, tasks, results, shared: SharedSearch) -> None:
+    """Loop of a worker process: searches the subtrees taken from the queue until it gets None."""
+    solver = IDAStarSolver(map, heuristic, deadlocks, **options)
+    start = State.from_map(map)
+    solver.poll = lambda stack, path_moves: poll(solver, stack, path_moves, tasks, shared)
+    if shared.max_nodes is not None:
+        # The limit is checked against the shared count, kept up to date on every expansion
+        solver.poll_interval = 1
+
+    while True:
+        with shared.idle.get_lock():
+            shared.idle.value += 1
+        moves = tasks.get()
+        with shared.idle.get_lock():
+            shared.idle.value -= 1
+        if moves is None:
+            return
+
+        # Messages are (kind, nodes expanded, solution or bound, best heuristic, moves that reached it,
+        # dead positions learned and hits since the last message), the main process saves the positions
+        solver.nodes_expanded = 0
+        if shared.stop.is_set():
+            results.put(('aborted', 0, None, solver.best_h, solver.best_path, solver.deadlock_db.take_learned()))
+            continue
+
+        solver.iteration = shared.iteration.value
+        solver.incomplete_depth = -1
+        solver.next_threshold = math.inf
+        try:
+            result = solver.search_subtree(start, moves, shared.threshold.value)
+        except SearchAborted:
+            result = None
+        # The polls counted the expansions up to the last multiple of the poll interval
+        with shared.nodes.get_lock():
+            shared.nodes.value += solver.nodes_expanded % solver.poll_interval
+
+        learned = solver.deadlock_db.take_learned()
+        if result is None:
+            results.put(('aborted', solver.nodes_expanded, None, solver.best_h, solver.best_path, learned))
+            continue
+
+        if result == 'FOUND':
+            results.put(('found', solver.nodes_expanded, solver.path, solver.best_h, solver.best_path, learned))
+        else:
+            results.put(('bound', solver.nodes_expanded, solver.next_threshold, solver.best_h, solver.best_path,
+                         learned))
+
+def poll(solver: IDAStarSolver, stack: List[list], path_moves: list, tasks, shared: SharedSearch) -> None:
+    """
+    Adds the expansions since the last poll to the shared count and stops the worker once a solution
+    was found or the node limit is reached, otherwise gives the untried moves of its shallowest
+    frame away as new subtrees while another worker waits for work.
+    """
+    with shared.nodes.get_lock():
+        shared.nodes.value += solver.poll_interval
+        nodes = shared.nodes.value
+    if shared.max_nodes is not None and nodes >= shared.max_nodes:
+        shared.stop.set()
+    if shared.stop.is_set():
+        raise SearchAborted()
+    if shared.idle.value == 0 or not tasks.empty():
+        return
+
+    for frame in stack:
+        # The frame's own loop iterates over the same iterator, so it ends with it
+        remaining = list(frame[2])
+        if not remaining:
+            continue
+
+        g = frame[1]
+        # The subtrees given away are no longer searched here: no dead proofs or bounds above them
+        solver.open_cuts += 1
+        solver.incomplete_depth = max(solver.incomplete_depth, g)
+        with shared.created.get_lock():
+            shared.created.value += len(remaining)
+        for move in remaining:
+            tasks.put(path_moves[:g] + [move])
+        return
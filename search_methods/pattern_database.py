@@ -0,0 +1,209 @@
+from sokoban.board import StaticBoard, OPPOSITE_MOVES
+from sokoban.moves import LEFT, RIGHT, UP, DOWN
+from search_methods.deadlock_db import level_hash
+
+from collections import deque
+from itertools import combinations
+from math import comb, inf
+from typing import Dict, List, Optional, Sequence, Tuple
+from weakref import WeakKeyDictionary
+import argparse
+import os
+import numpy as np
+
+# Number of boxes solved together by a pattern database
+DEFAULT_PATTERN_SIZE = 2
+
+# Where pattern databases are stored, one .npy file per level and pattern size
+DEFAULT_PATTERN_DIRECTORY = 'pattern_databases'
+
+# Stored in place of an infinite cost, for placements that can never be solved
+UNREACHABLE_COST = np.iinfo(np.uint16).max
+
+# Above this many boxes the best split into patterns is no longer searched, boxes are grouped in cell order
+MAX_PARTITIONED_BOXES = 10
+
+class PatternDatabase:
+    """
+    Exact costs of solving every placement of `size` boxes alone on the level, walls and targets fixed.
+
+    The cost of a placement is the number of box moves (pushes or pulls) needed to bring its boxes onto
+    distinct targets, where a box moves when the cell the player would stand on is free. The player's
+    walk is ignored, so the cost is a lower bound for those boxes in the full level; since every move
+    moves a single box, the costs of disjoint groups of boxes add up to a lower bound as well.
+
+    Placements are sets of floor cells, ranked with the combinatorial number system into a flat
+    uint16 array that is written once by build() and memory-mapped at solve time.
+    """
+    def __init__(self, board: StaticBoard, size: int, costs: np.ndarray) -> None:
+        self.board = board
+        self.size = size
+        self.floor: List[int] = floor_cells(board)
+        self.floor_index: Dict[int, int] = {cell: index for index, cell in enumerate(self.floor)}
+        # binomials[i][j] = C(i, j), for ranking placements
+        self.binomials = [[comb(i, j) for j in range(size + 1)] for i in range(len(self.floor) + 1)]
+
+        expected = comb(len(self.floor), size)
+        if len(costs) != expected:
+            raise ValueError(f'Pattern database has {len(costs)} entries, the level needs {expected}')
+        self.costs = costs
+
+    @staticmethod
+    def path_for(board: StaticBoard, size: int, directory: str = DEFAULT_PATTERN_DIRECTORY) -> str:
+        return os.path.join(directory, f'{level_hash(board)}_k{size}.npy')
+
+    @classmethod
+    def load(cls, board: StaticBoard, size: int = DEFAULT_PATTERN_SIZE,
+             directory: str = DEFAULT_PATTERN_DIRECTORY) -> 'PatternDatabase':
+        """Memory-maps the database of the level, which has to be built offline first"""
+        path = cls.path_for(board, size, directory)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f'No pattern database at {path}, build it first with: '
+                f'python -m search_methods.pattern_database <level file> --size {size}'
+            )
+        return cls(board, size, np.load(path, mmap_mode='r'))
+
+    def rank(self, cells: Sequence[int]) -> int:
+        """Index of a placement: sum of C(floor index, position) over its sorted cells"""
+        floor_index = self.floor_index
+        binomials = self.binomials
+        indices = sorted(floor_index[cell] for cell in cells)
+        return sum(binomials[index][position + 1] for position, index in enumerate(indices))
+
+    def group_cost(self, cells: Sequence[int]) -> float:
+        """Cost of solving the boxes on the cells alone, smaller leftover groups use the box distances of the board"""
+        if len(cells) != self.size:
+            nearest_box_distance = self.board.nearest_box_distance
+            return sum(nearest_box_distance[cell] for cell in cells)
+
+        cost = self.costs[self.rank(cells)]
+        return inf if cost == UNREACHABLE_COST else int(cost)
+
+    def cost(self, boxes: Sequence[int]) -> float:
+        """
+        Lower bound for all the boxes: the best split of the boxes into groups of `size`,
+        summing the exact cost of each group
+        """
+        boxes = sorted(boxes)
+        size = self.size
+        if len(boxes) > MAX_PARTITIONED_BOXES:
+            return sum(self.group_cost(boxes[i:i + size]) for i in range(0, len(boxes), size))
+
+        best: Dict[int, float] = {0: 0}
+
+        def best_split(remaining: int) -> float:
+            if remaining in best:
+                return best[remaining]
+
+            members = [i for i in range(len(boxes)) if remaining >> i & 1]
+            first, others = members[0], members[1:]
+            result = -inf
+            for rest in combinations(others, min(size, len(members)) - 1):
+                group = (first,) + rest
+                group_mask = 0
+                for i in group:
+                    group_mask |= 1 << i
+                value = self.group_cost([boxes[i] for i in group])
+                if value == inf:
+                    # The group alone can not be solved, so neither can the level
+                    best[remaining] = inf
+                    return inf
+                value += best_split(remaining & ~group_mask)
+                result = max(result, value)
+
+            best[remaining] = result
+            return result
+
+        return best_split((1 << len(boxes)) - 1)
+
+def floor_cells(board: StaticBoard) -> List[int]:
+    """Cells that are not walls, in index order"""
+    return [cell for cell in range(board.size) if not board.is_wall[cell]]
+
+def build(board: StaticBoard, size: int = DEFAULT_PATTERN_SIZE, directory: str = DEFAULT_PATTERN_DIRECTORY) -> str:
+    """
+    Solves every placement of `size` boxes with a breadth-first search backwards from the placements
+    on targets, and writes the costs to the .npy file of the level. Returns its path.
+    """
+    floor = floor_cells(board)
+    floor_index = {cell: index for index, cell in enumerate(floor)}
+    binomials = [[comb(i, j) for j in range(size + 1)] for i in range(len(floor) + 1)]
+    move_table = board.move_table
+
+    def rank(cells) -> int:
+        indices = sorted(floor_index[cell] for cell in cells)
+        return sum(binomials[index][position + 1] for position, index in enumerate(indices))
+
+    os.makedirs(directory, exist_ok=True)
+    path = PatternDatabase.path_for(board, size, directory)
+    temporary_path = path + '.tmp.npy'
+    costs = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=np.uint16, shape=(comb(len(floor), size),))
+    costs[:] = UNREACHABLE_COST
+
+    queue = deque()
+    for placement in combinations(sorted(board.target_cells), size):
+        costs[rank(placement)] = 0
+        queue.append(frozenset(placement))
+
+    while queue:
+        placement = queue.popleft()
+        next_cost = int(costs[rank(placement)]) + 1
+        for box in placement:
+            for move in (LEFT, RIGHT, UP, DOWN):
+                # The box reached its cell by moving in this direction from the previous cell
+                previous = move_table[OPPOSITE_MOVES[move]][box]
+                if previous < 0 or previous in placement:
+                    continue
+
+                before = placement - {box} | {previous}
+                behind = move_table[OPPOSITE_MOVES[move]][previous]
+                beyond = move_table[move][box]
+                can_push = behind >= 0 and behind not in before
+                can_pull = beyond >= 0 and beyond not in before
+                if not can_push and not can_pull:
+                    continue
+
+                index = rank(before)
+                if costs[index] == UNREACHABLE_COST:
+                    costs[index] = next_cost
+                    queue.append(before)
+
+    costs.flush()
+    del costs
+    os.replace(temporary_path, path)
+    return path
+
+# Pattern databases memory-mapped so far, per level board
+_databases: "WeakKeyDictionary[StaticBoard, PatternDatabase]" = WeakKeyDictionary()
+
+def pattern_size_for(board: StaticBoard) -> int:
+    """Pattern size used for the level: the default, or its number of targets if that is smaller"""
+    return max(1, min(DEFAULT_PATTERN_SIZE, len(board.target_cells)))
+
+def pattern_database_for(board: StaticBoard) -> PatternDatabase:
+    """Pattern database of the level, with patterns no larger than its number of targets"""
+    database = _databases.get(board)
+    if database is None:
+        database = _databases[board] = PatternDatabase.load(board, pattern_size_for(board))
+    return database
+
+def main() -> None:
+    from sokoban.map import Map
+
+    parser = argparse.ArgumentParser(description='Build the pattern databases of Sokoban levels offline')
+    parser.add_argument('test_files', nargs='+', help='Level file(s) to build the databases for')
+    parser.add_argument('--size', type=int, default=DEFAULT_PATTERN_SIZE, help='Number of boxes per pattern')
+    parser.add_argument('--output-dir', default=DEFAULT_PATTERN_DIRECTORY, help='Directory of the .npy files')
+    args = parser.parse_args()
+
+    for test_file in args.test_files:
+        board = Map.from_yaml(test_file).board
+        if len(board.target_cells) < args.size:
+            print(f'{test_file}: fewer targets than boxes per pattern, skipped')
+            continue
+        path = build(board, args.size, args.output_dir)
+        print(f'{test_file}: {comb(len(floor_cells(board)), args.size)} placements written to {path}')
+
+if __name__ == '__main__':
+    main()
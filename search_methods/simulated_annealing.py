@@ -1,7 +1,36 @@
-from search_methods.solver import Solver
+from search_methods.solver import Solver, SOLVED, TIMEOUT, UNSOLVABLE, EXHAUSTED
+from search_methods.deadlocks import compile_deadlocks, DeadlockEngine
+from sokoban.board import OPPOSITE_MOVES
 from sokoban.map import Map
-from search_methods.heuristics import total_manhattan_distance
+from sokoban.moves import LEFT, RIGHT, UP, DOWN
+from sokoban.state import State
+from search_methods.heuristics import DEFAULT_CACHE_ENTRIES
+from typing import List, Optional, Tuple
+from collections import deque
+from math import exp, inf
 import numpy as np
+import time
+
+# Temperature steps between two checks of the cancel event and of the deadline
+CANCEL_CHECK_INTERVAL = 1000
+
+# Uniform numbers drawn from the generator at once, two are used per step
+RANDOM_BLOCK = 1 << 14
+
+# Adaptive schedule: steps per window, and the windows without a new best heuristic before a restart
+ADAPTIVE_WINDOW = 1000
+STAGNANT_WINDOWS = 5
+# Below this share of accepted moves in a window the chain is frozen and gets reheated
+LOW_ACCEPTANCE = 0.02
+# Below this many distinct states per accepted move the chain is oscillating and gets reheated
+OSCILLATION_RATIO = 0.25
+# Temperature factor of a reheat, capped by the initial temperature
+REHEAT_FACTOR = 2.0
+# Steps without a new best heuristic after which an adaptive chain gives up
+DEFAULT_PATIENCE = 200_000
+
+# Steps a visited state stays forbidden for, 0 disables the tabu memory
+DEFAULT_TABU_TENURE = 8
 
 class SimulatedAnnealingSolver(Solver):
     def __init__(self, 
@@ -10,78 +39,368 @@ class SimulatedAnnealingSolver(Solver):
                  deadlocks,
                  initial_temp: float = 1000,
                  decay_rate: float = 0.000003,
-                 min_temp: float = 1) -> None:
-        super().__init__(map)
+                 min_temp: float = 1,
+                 push_level: bool = False,
+                 cache_size: int = DEFAULT_CACHE_ENTRIES,
+                 seed: Optional[int] = None,
+                 alpha: float = 0.01,
+                 adaptive: bool = False,
+                 window: int = ADAPTIVE_WINDOW,
+                 patience: Optional[int] = DEFAULT_PATIENCE,
+                 tabu_tenure: int = DEFAULT_TABU_TENURE,
+                 deadline: Optional[float] = None,
+                 max_nodes: Optional[int] = None) -> None:
+        super().__init__(map, push_level, cache_size, deadline, max_nodes)
         self.initial_temp = initial_temp
         self.decay_rate = decay_rate
         self.min_temp = min_temp
-        self.alpha = 0.01
+        self.alpha = alpha
+        if window <= 0:
+            raise ValueError(f'Adaptive window must hold at least one step, got {window}')
+        # Adaptive schedule: every window, reheat a frozen or oscillating chain, restart a stagnating
+        # one from the best state seen, and stop once patience steps brought no better state
+        self.adaptive = adaptive
+        self.window = window
+        self.patience = patience
+        if tabu_tenure < 0:
+            raise ValueError(f'Tabu tenure can not be negative, got {tabu_tenure}')
+        # Moves back into a state visited in the last tabu_tenure steps are rejected
+        self.tabu_tenure = tabu_tenure
         self.heuristic = heuristic
         self.deadlocks = deadlocks
 
+        # A chain is reproducible from its seed, one is drawn and recorded when none is given
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.rng = np.random.default_rng(self.seed)
+        # Set by parallel runs, the chain stops early once it is set
+        self.cancel_event = None
+
         self.nodes_expanded = 0
         self.pull_moves = 0
+        self.stats = {}
+        # One entry per window of the adaptive schedule
+        self.schedule_trace: List[dict] = []
 
         self.move_path: list[int] = []
 
-    def softmax(self, x: np.array) -> float:
-        e_x = np.exp(x - np.max(x))
-        return e_x / e_x.sum()
+    def step_table(self, board) -> List[tuple]:
+        """Per player cell, (direction, cell in front, cell beyond it, cell behind) of every direction not blocked by a wall."""
+        move_table = board.move_table
+        return [
+            tuple(
+                (direction, move_table[direction][cell], move_table[direction][move_table[direction][cell]],
+                 move_table[OPPOSITE_MOVES[direction]][cell])
+                for direction in (LEFT, RIGHT, UP, DOWN)
+                if move_table[direction][cell] >= 0
+            ) if not board.is_wall[cell] else ()
+            for cell in range(board.size)
+        ]
+
+    def scored_moves(self, state: State, engine: DeadlockEngine, steps: List[tuple]) -> Tuple[list, List[float]]:
+        """
+        Successor moves with the change they make to the sum of Manhattan distances of the boxes
+        to their nearest targets, inf for a deadlock, without building the successor states.
+        A walk changes nothing; a box move changes the distance of the one box it moves.
+        """
+        board = state.board
+        nearest = board.nearest_manhattan
+        boxes = state.boxes
+
+        moves = []
+        deltas = []
+        # (move, cell the box leaves, cell it reaches) of every box move, scored once collected
+        box_moves = []
+        if self.push_level:
+            move_table = board.move_table
+            for stand, move in state.box_moves():
+                step = move_table[move - 4]
+                front = step[stand]
+                if front in boxes:
+                    box_moves.append(((stand, move), front, step[front]))
+                else:
+                    box_moves.append(((stand, move), move_table[OPPOSITE_MOVES[move - 4]][stand], stand))
+        else:
+            player = state.player
+            for direction, front, beyond, behind in steps[player]:
+                if front in boxes:
+                    if beyond >= 0 and beyond not in boxes:
+                        # The plain move and the box move both push the box
+                        box_moves.append((direction, front, beyond))
+                        box_moves.append((direction + 4, front, beyond))
+                else:
+                    moves.append(direction)
+                    deltas.append(0)
+                    if behind in boxes:
+                        box_moves.append((direction + 4, behind, player))
+
+        dead_mask = engine.dead_mask
+        local_rules = engine.check_squares or engine.check_freeze
+        box_mask = state.box_mask
+        for move, source, target in box_moves:
+            moves.append(move)
+            if dead_mask >> target & 1 or (
+                    local_rules and engine.is_local_deadlock(box_mask ^ (1 << source) ^ (1 << target), target)):
+                deltas.append(inf)
+            else:
+                deltas.append(nearest[target] - nearest[source])
+
+        return moves, deltas
 
     def solve(self) -> list[int]:
-        current_map = self.map.copy()
+        start = State.from_map(self.map)
+        # Accepted moves are applied in place, the start is kept to expand the path afterwards
+        current_map = start.copy()
         temp = self.initial_temp
+        self.start_budget()
+        started = self.started
+        engine = compile_deadlocks(start.board, self.deadlocks)
+        nearest = start.board.nearest_manhattan
+        rng = self.rng
+        decay = 1 - self.decay_rate
+
+        # Sum of the nearest-target distances of the boxes, updated by the change of each accepted move
+        curr_total = sum(nearest[box] for box in current_map.boxes)
+        curr_h = self.heuristic(current_map, self.deadlocks, cache=self.heuristic_cache)
+        steps_from = self.step_table(start.board)
+        randoms = rng.random(RANDOM_BLOCK).tolist()
+        position = 0
+
+        # Looked up once, the loop runs millions of times
+        heuristic, deadlocks, cache = self.heuristic, self.deadlocks, self.heuristic_cache
+        scored_moves, make_move, move_path = self.scored_moves, self.make_move, self.move_path
+        min_temp, alpha, cancel_event, max_nodes = self.min_temp, self.alpha, self.cancel_event, self.max_nodes
+        adaptive, window = self.adaptive, self.window
+        state_key, tenure = self.state_key, self.tabu_tenure
 
         # count every time we generate/evaluate a successor
         nodes = 0
+        steps = 0
+        accepted = 0
+        cancelled = False
+        stop_reason = 'min_temp'
+
+        # The path holds no state twice: path_keys[i] is the key of the state before move i, found at
+        # index i of path_index, and path_records[i] the undo record that brings the state back there
+        path_keys = [state_key(current_map)]
+        path_index = {path_keys[0]: 0}
+        path_records = []
+        loops_cut = 0
+        loop_moves = 0
+        # Tabu memory: last step every recent state was visited at, expired in visiting order
+        tabu_visits = {path_keys[0]: 0} if tenure else {}
+        tabu_queue = deque([(0, path_keys[0])]) if tenure else deque()
+        tabu_rejected = 0
+
+        # Best state seen, as an undo record, with the length of the path that reached it
+        best_h = curr_h
+        best_step = 0
+        best_record = (current_map.player, current_map.boxes, current_map.undo_moves,
+                       current_map.key, current_map.box_mask, current_map.moved_box)
+        best_length = 0
+        best_total = curr_total
+        # The path to the best state, saved once a loop cut removes it from the current path
+        best_snapshot = None
+        # Statistics of the current window of the adaptive schedule
+        window_accepted = 0
+        window_states = set()
+        stagnant = 0
+        self.schedule_trace = []
 
-        while temp > self.min_temp:
-            if current_map.is_solved():
+        solved = current_map.is_solved()
+        if curr_h == inf:
+            # The start is the only state given a full deadlock check, a chain never gets out of its deadlock
+            stop_reason = 'deadlock'
+        while temp > min_temp and not solved and stop_reason != 'deadlock':
+            if steps % CANCEL_CHECK_INTERVAL == 0:
+                if cancel_event is not None and cancel_event.is_set():
+                    cancelled = True
+                    stop_reason = 'cancelled'
+                    break
+                if self.past_deadline():
+                    stop_reason = 'budget'
+                    break
+
+            if adaptive and steps and steps % window == 0:
+                acceptance = window_accepted / window
+                event = None
+                if best_step > steps - window:
+                    stagnant = 0
+                else:
+                    stagnant += 1
+                    oscillating = window_accepted > 0 and len(window_states) < OSCILLATION_RATIO * window_accepted
+                    if stagnant >= STAGNANT_WINDOWS:
+                        # Back to the best state seen, the moves made since are dropped. Like every state
+                        # of the chain it was reached by a move checked from a live state, so the local
+                        # deadlock checks of its moves and the cached verdict of its boxes stay valid
+                        current_map.undo_move(best_record)
+                        if best_snapshot is not None:
+                            move_path[:], path_records[:], path_keys[:] = best_snapshot
+                            path_index = {old_key: index for index, old_key in enumerate(path_keys)}
+                        else:
+                            for old_key in path_keys[best_length + 1:]:
+                                del path_index[old_key]
+                            del path_keys[best_length + 1:]
+                            del path_records[best_length:]
+                            del move_path[best_length:]
+                        curr_h, curr_total = best_h, best_total
+                        temp = min(temp * REHEAT_FACTOR, self.initial_temp)
+                        stagnant = 0
+                        event = 'restart'
+                    elif oscillating or acceptance < LOW_ACCEPTANCE:
+                        # Frozen, or circling a handful of states: heat up to get out
+                        temp = min(temp * REHEAT_FACTOR, self.initial_temp)
+                        event = 'reheat'
+
+                self.schedule_trace.append({
+                    'step': steps,
+                    'temp': temp,
+                    'acceptance': acceptance,
+                    'distinct_states': len(window_states),
+                    'best_h': best_h,
+                    'event': event,
+                })
+                window_accepted = 0
+                window_states.clear()
+
+                if self.patience is not None and steps - best_step >= self.patience:
+                    stop_reason = 'no_improvement'
+                    break
+
+            steps += 1
+
+            moves, deltas = scored_moves(current_map, engine, steps_from)
+            nodes += len(moves)
+            if max_nodes is not None and nodes > max_nodes:
+                # Scoring these moves went past the node limit, the step is not taken
+                stop_reason = 'budget'
                 break
 
-            curr_h = self.heuristic(current_map, self.deadlocks)
-            moves = current_map.filter_possible_moves()
-            next_states = []
-            next_moves  = []
-            
-            for mv in moves:
-                nodes += 1
-                m2 = current_map.copy()
-                try:
-                    m2.apply_move(mv)
-                    next_states.append(m2)
-                    next_moves.append(mv)
-                except ValueError:
-                    continue
-
-            if not next_states:
-                temp *= (1 - self.decay_rate)
+            best = min(deltas, default=inf)
+            if best == inf:
+                temp *= decay
                 continue
-            
-            scores = [ total_manhattan_distance(s, self.deadlocks)
-                       for s in next_states ]
 
-            idx = np.random.choice(len(next_states),
-                                   p=self.softmax(-np.array(scores)))
-            sel_state = next_states[idx]
-            sel_score = scores[idx]
-            sel_move  = next_moves[idx]
+            if position + 2 > RANDOM_BLOCK:
+                randoms = rng.random(RANDOM_BLOCK).tolist()
+                position = 0
+            pick, threshold = randoms[position], randoms[position + 1]
+            position += 2
+
+            if best == max(deltas):
+                # Every move scores the same, e.g. only walks: the softmax is uniform
+                idx = int(pick * len(deltas))
+            else:
+                # Softmax over -score, shifted by the best move so the largest weight is 1
+                weights = [exp(best - delta) for delta in deltas]
+                pick *= sum(weights)
+                idx = 0
+                for idx, weight in enumerate(weights):
+                    pick -= weight
+                    if pick < 0:
+                        break
+                while weights[idx] == 0:
+                    idx -= 1
+            sel_score = curr_total + deltas[idx]
 
             accept = (sel_score < curr_h) or \
-                     (np.exp((curr_h - sel_score)/(temp*self.alpha))
-                        > np.random.rand())
+                     (exp((curr_h - sel_score)/(temp*alpha)) > threshold)
 
             if accept:
-                current_map = sel_state
-                self.move_path.append(sel_move)
+                record = make_move(current_map, moves[idx])
+                key = state_key(current_map)
+                last_visit = tabu_visits.get(key)
+                if last_visit is not None and steps - last_visit <= tenure:
+                    # Visited too recently: the move is undone and the chain stays where it is
+                    current_map.undo_move(record)
+                    tabu_rejected += 1
+                    accept = False
+
+            if accept:
+                curr_total = sel_score
+                accepted += 1
+                # Only a move of a box can solve the level
+                if current_map.moved_box >= 0:
+                    solved = current_map.is_solved()
+
+                if tenure:
+                    tabu_visits[key] = steps
+                    tabu_queue.append((steps, key))
+                    while tabu_queue[0][0] < steps - tenure:
+                        visit, old_key = tabu_queue.popleft()
+                        if tabu_visits[old_key] == visit:
+                            del tabu_visits[old_key]
+
+                index = path_index.get(key)
+                if index is None:
+                    move_path.append(moves[idx])
+                    path_records.append(record)
+                    path_keys.append(key)
+                    path_index[key] = len(move_path)
+                else:
+                    # The state recurs: the loop since its first visit is cut out of the path
+                    if index < best_length and best_snapshot is None:
+                        best_snapshot = (move_path[:best_length], path_records[:best_length], path_keys[:best_length + 1])
+                    current_map.undo_move(path_records[index] if index < len(path_records) else record)
+                    for old_key in path_keys[index + 1:]:
+                        del path_index[old_key]
+                    loop_moves += len(move_path) - index + 1
+                    loops_cut += 1
+                    del path_keys[index + 1:]
+                    del path_records[index:]
+                    del move_path[index:]
+
+                curr_h = heuristic(current_map, deadlocks, cache=cache)
+
+                if adaptive:
+                    window_accepted += 1
+                    window_states.add(current_map.key)
+                if curr_h < best_h:
+                    best_h, best_step, best_total = curr_h, steps, curr_total
+                    best_record = (current_map.player, current_map.boxes, current_map.undo_moves,
+                                   current_map.key, current_map.box_mask, current_map.moved_box)
+                    best_length = len(move_path)
+                    best_snapshot = None
+
+            temp *= decay
 
-            temp *= (1 - self.decay_rate)
+        if solved:
+            stop_reason = 'solved'
 
         self.nodes_expanded = nodes
+        # Without a solution, the path to the best state seen is the partial result
+        best_path = best_snapshot[0] if best_snapshot is not None else move_path[:best_length]
+        self.move_path = self.expand_moves(start, self.move_path)
+        # Pulls of the path returned or reported: a state counts those of the path that reached it, as loop
+        # cuts restore the count along with the state, and walks added by the expansion pull nothing
+        self.pull_moves = current_map.undo_moves if solved else best_record[2]
 
-        final_map = self.map.copy()
-        for mv in self.move_path:
-            final_map.apply_move(mv)
-        self.pull_moves = final_map.undo_moves
+        self.stats = {
+            'seed': self.seed,
+            'initial_temp': self.initial_temp,
+            'alpha': self.alpha,
+            'steps': steps,
+            'accepted': accepted,
+            'nodes_expanded': nodes,
+            'final_temp': temp,
+            'final_h': self.heuristic(current_map, self.deadlocks, cache=self.heuristic_cache),
+            'solved': solved,
+            'cancelled': cancelled,
+            'stop_reason': stop_reason,
+            'tabu_rejected': tabu_rejected,
+            'loops_cut': loops_cut,
+            'loop_moves': loop_moves,
+            'moves': len(self.move_path),
+            'best_h': best_h,
+            'elapsed': time.perf_counter() - started,
+        }
+        if self.adaptive:
+            self.stats['reheats'] = sum(entry['event'] == 'reheat' for entry in self.schedule_trace)
+            self.stats['restarts'] = sum(entry['event'] == 'restart' for entry in self.schedule_trace)
+            self.stats['schedule'] = self.schedule_trace
 
-        return self.move_path
+        if solved:
+            self.finish(SOLVED, self.move_path, nodes, best_h)
+            return self.move_path
+        status = {'budget': TIMEOUT, 'deadlock': UNSOLVABLE}.get(stop_reason, EXHAUSTED)
+        self.finish(status, self.expand_moves(start, best_path), nodes, best_h)
+        return None
@@ -1,9 +1,134 @@
 from sokoban.map import Map
+from sokoban.state import State
+from search_methods.heuristics import HeuristicCache, DEFAULT_CACHE_ENTRIES
+
+from typing import List, Optional
+import math
+import time
+
+# How a solve ended: with a solution, out of time or nodes, with the level proven unsolvable,
+# or with an incomplete search (depth limit, annealing schedule) done without a solution
+SOLVED = 'solved'
+TIMEOUT = 'timeout'
+UNSOLVABLE = 'unsolvable'
+EXHAUSTED = 'exhausted'
+
+# Expansions between two reads of the clock in the search loops, the node limit is checked on every one
+BUDGET_CHECK_INTERVAL = 1024
+
+class BudgetExhausted(Exception):
+    """Raised inside a search loop once the deadline or the node limit of the solve is reached"""
+
+class SolveResult:
+    """
+    Outcome of a solve: its status, the moves of the solution or, without one, of the path to the
+    state with the smallest heuristic reached, the nodes expanded over the whole solve and the
+    time it took.
+    """
+    def __init__(self, status: str, moves: List[int], nodes_expanded: int, elapsed: float,
+                 best_h: float = math.inf) -> None:
+        self.status = status
+        self.moves = moves
+        self.nodes_expanded = nodes_expanded
+        self.elapsed = elapsed
+        self.best_h = best_h
+
+    @property
+    def solved(self) -> bool:
+        return self.status == SOLVED
+
+    def __repr__(self) -> str:
+        return (f'SolveResult(status={self.status!r}, moves={len(self.moves)}, nodes_expanded={self.nodes_expanded}, '
+                f'elapsed={self.elapsed:.3f}, best_h={self.best_h})')
 
 class Solver:
 
-    def __init__(self, map: Map) -> None:
+    def __init__(self, map: Map, push_level: bool = False, cache_size: int = DEFAULT_CACHE_ENTRIES,
+                 deadline: Optional[float] = None, max_nodes: Optional[int] = None) -> None:
         self.map = map
+        # Push-level search branches only on box moves, the walks between them are filled in afterwards
+        self.push_level = push_level
+        # Memo of the box-only part of the heuristic, None when disabled with a size of 0
+        self.heuristic_cache = HeuristicCache(cache_size) if cache_size > 0 else None
+
+        # Budget of a solve: seconds of wall-clock time after it starts, and expanded nodes
+        if deadline is not None and deadline <= 0:
+            raise ValueError(f'Deadline must be a positive number of seconds, got {deadline}')
+        if max_nodes is not None and max_nodes <= 0:
+            raise ValueError(f'Node limit must be positive, got {max_nodes}')
+        self.deadline = deadline
+        self.max_nodes = max_nodes
+        self.started = 0.0
+        self.stop_time = math.inf
+        # Clock time no later than which the solve stops, set by a parallel solve it is part of;
+        # perf_counter reads the same clock in every process of the machine
+        self.outer_stop_time = math.inf
+        # Filled in by solve, whether it found a solution or not
+        self.result: Optional[SolveResult] = None
 
     def solve(self):
         raise NotImplementedError
+
+    def run(self) -> SolveResult:
+        """Solves the level and returns the structured result instead of the bare solution."""
+        self.solve()
+        return self.result
+
+    def start_budget(self) -> None:
+        """Starts the clock of the solve, the deadline counts from here, up to outer_stop_time."""
+        self.started = time.perf_counter()
+        self.stop_time = self.started + self.deadline if self.deadline is not None else math.inf
+        self.stop_time = min(self.stop_time, self.outer_stop_time)
+
+    def out_of_budget(self, nodes: int) -> bool:
+        """
+        Called before each expansion with the nodes expanded so far: checks the node limit every
+        time, and the deadline every BUDGET_CHECK_INTERVAL nodes.
+        """
+        if self.over_node_limit(nodes):
+            return True
+        return nodes % BUDGET_CHECK_INTERVAL == 0 and self.past_deadline()
+
+    def over_node_limit(self, nodes: int) -> bool:
+        """Checks if no further node may be expanded after these."""
+        return self.max_nodes is not None and nodes >= self.max_nodes
+
+    def past_deadline(self) -> bool:
+        return time.perf_counter() >= self.stop_time
+
+    def finish(self, status: str, moves: Optional[List[int]], nodes: int, best_h: float = math.inf) -> SolveResult:
+        """Records the result of the solve started by start_budget."""
+        self.result = SolveResult(status, list(moves or []), nodes, time.perf_counter() - self.started, best_h)
+        return self.result
+
+    def successor_moves(self, state: State) -> list:
+        """Moves to branch on: single moves, or (cell to walk to, box move) pairs at push level."""
+        if self.push_level:
+            return state.box_moves()
+        return state.filter_possible_moves()
+
+    def make_move(self, state: State, move) -> tuple:
+        """Applies a move returned by successor_moves in place and returns its undo record."""
+        if self.push_level:
+            return state.make_box_move(*move)
+        return state.make_move(move)
+
+    def state_key(self, state: State) -> int:
+        """Key identifying the state; at push level, states that only differ by a walk share it."""
+        if self.push_level:
+            return state.canonical_key()
+        return state.key
+
+    @property
+    def cache_hits(self) -> int:
+        return self.heuristic_cache.hits if self.heuristic_cache is not None else 0
+
+    @property
+    def cache_misses(self) -> int:
+        return self.heuristic_cache.misses if self.heuristic_cache is not None else 0
+
+    def expand_moves(self, start: State, moves: list) -> list:
+        """Turns the moves the search branched on back into the full list of moves."""
+        if self.push_level:
+            return start.expand_box_moves(moves)
+        return list(moves)
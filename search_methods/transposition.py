@@ -0,0 +1,115 @@
+from array import array
+from typing import Optional
+
+# Default number of entries of the IDA* transposition table, 32 bytes each
+DEFAULT_TABLE_ENTRIES = 1 << 20
+
+# Entries probed for a key, starting at its home slot
+BUCKET_SIZE = 4
+
+
+class TranspositionTable:
+    """
+    Fixed-size, open-addressed table of the states IDA* has reached, kept for the whole solve.
+
+    Each entry holds a state key, the smallest depth g the state was reached at in the iteration
+    that stored it, and a lower bound on its remaining cost. The depth only prunes transpositions
+    inside one iteration, while the bound is kept across iterations: it starts at the heuristic and
+    is raised to the smallest f that exceeded the threshold below the state, so a subtree already
+    proven to exceed the next threshold is skipped without expanding it again.
+
+    A key lives in one of the BUCKET_SIZE slots following its home slot. When they are all taken,
+    the entry of the oldest iteration is replaced, and among entries of the same age the deepest one,
+    since shallow entries cut off the largest subtrees. The arrays are allocated once, so the memory
+    used never grows during a solve. Key 0 marks an empty slot.
+    """
+    def __init__(self, size: int = DEFAULT_TABLE_ENTRIES) -> None:
+        if size < BUCKET_SIZE:
+            raise ValueError(f'Transposition table needs at least {BUCKET_SIZE} entries, got {size}')
+
+        # Rounded down to a power of two, so the home slot is a mask of the key
+        capacity = 1 << (size.bit_length() - 1)
+        self.capacity = capacity
+        self.mask = capacity - 1
+
+        self.keys = array('Q', bytes(8 * capacity))
+        self.depths = array('l', [0]) * capacity
+        self.bounds = array('d', [0.0]) * capacity
+        self.iterations = array('l', [0]) * capacity
+
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def __len__(self) -> int:
+        return self.capacity - self.keys.count(0)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def find(self, key: int) -> int:
+        """Slot holding the key, -1 if it is not in the table"""
+        self.lookups += 1
+        keys = self.keys
+        mask = self.mask
+        home = key & mask
+        for offset in range(BUCKET_SIZE):
+            slot = (home + offset) & mask
+            if keys[slot] == key:
+                self.hits += 1
+                return slot
+        return -1
+
+    def store(self, key: int, depth: int, bound: float, iteration: int, slot: int = -1) -> int:
+        """
+        Records the key reached at the depth in the iteration, in its own slot when given,
+        otherwise in an empty or replaced one. The bound never decreases for a key. Returns the slot.
+        """
+        keys = self.keys
+        if slot < 0 or keys[slot] != key:
+            slot = self.place(key)
+
+        if keys[slot] == key:
+            if bound < self.bounds[slot]:
+                bound = self.bounds[slot]
+        else:
+            keys[slot] = key
+        self.depths[slot] = depth
+        self.bounds[slot] = bound
+        self.iterations[slot] = iteration
+        self.stores += 1
+        return slot
+
+    def raise_bound(self, key: int, bound: float) -> None:
+        """Raises the remaining-cost bound of the key, if it is still in the table"""
+        keys = self.keys
+        mask = self.mask
+        home = key & mask
+        for offset in range(BUCKET_SIZE):
+            slot = (home + offset) & mask
+            if keys[slot] == key:
+                if bound > self.bounds[slot]:
+                    self.bounds[slot] = bound
+                return
+
+    def place(self, key: int) -> int:
+        """Slot for the key: its current one, an empty one, or the entry chosen for replacement"""
+        keys = self.keys
+        iterations = self.iterations
+        depths = self.depths
+        mask = self.mask
+        home = key & mask
+
+        victim: Optional[int] = None
+        for offset in range(BUCKET_SIZE):
+            slot = (home + offset) & mask
+            stored = keys[slot]
+            if stored == key or stored == 0:
+                return slot
+            if victim is None or (iterations[slot], -depths[slot]) < (iterations[victim], -depths[victim]):
+                victim = slot
+
+        self.replacements += 1
+        return victim
@@ -2,6 +2,7 @@ from .dummy import Dummy
 from .box import Box
 from .player import Player
 from .map import Map
+from .state import State
 from .moves import (
     LEFT, 
     RIGHT, 
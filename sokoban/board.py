@@ -0,0 +1,221 @@
+from .moves import *
+
+from collections import deque
+from typing import FrozenSet, Iterable, List, Optional, Tuple
+from array import array
+from math import inf
+import random
+
+
+__all__ = ['StaticBoard', 'MOVE_OFFSETS', 'OPPOSITE_MOVES']
+
+
+# Offset applied to a position by each move, matching Dummy.get_future_position
+MOVE_OFFSETS = {
+    LEFT:  (0, -1),
+    RIGHT: (0, 1),
+    UP:    (1, 0),
+    DOWN:  (-1, 0),
+}
+
+OPPOSITE_MOVES = {
+    LEFT:  RIGHT,
+    RIGHT: LEFT,
+    UP:    DOWN,
+    DOWN:  UP,
+}
+
+
+# Fixed seed, so the Zobrist keys of a level are the same in every process and every run
+ZOBRIST_SEED = 0x50C0BA4
+
+
+class StaticBoard:
+    '''
+    StaticBoard Class records the part of a level that never changes during a solve.
+    It is built once per level and shared by reference by every map, state, heuristic and deadlock checker.
+
+    Cells are addressed either by (x, y) position or by a flat index: cell = x * width + y
+
+    Attributes:
+    length: length of the map
+    width: width of the map
+    size: number of cells on the map
+    walls: frozenset of obstacle positions
+    targets: frozenset of target positions
+    target_list: target positions in the order given by the level
+    wall_cells / target_cells: the same sets, as flat indices
+    target_cell_list: target_list as flat indices
+    is_wall / is_target: per-cell flags, indexed by flat index
+    coords: (x, y) position of every flat index
+    neighbours: per-cell tuple of the adjacent cells that are not walls
+    move_table: per-move list of the cell reached from every cell, -1 for an obstacle or the outside of the map
+    reachable_cells: positions a box can be pushed from to reach some target
+    dead_squares: positions a box can never be pushed to a target from
+    dead_cells: the same set, as flat indices
+    target_distances: per-cell walking distance to the nearest target, ignoring boxes
+    box_distances: per-target (in target_list order) list of the box moves needed to bring a box from every cell to it
+    nearest_box_distance: per-cell minimum of box_distances over all targets
+    manhattan_distances / nearest_manhattan: the same two tables for plain Manhattan distances
+    manhattan_rows: per-cell Manhattan distances to every cell, filled in by manhattan_row on first use
+    zobrist_player / zobrist_boxes: per-cell random 64-bit keys for the player and for a box
+    '''
+    def __init__(self, length: int, width: int, obstacles: Iterable[Tuple[int, int]], targets: Iterable[Tuple[int, int]]):
+        self.length = length
+        self.width = width
+        self.size = length * width
+
+        self.walls: FrozenSet[Tuple[int, int]] = frozenset(tuple(obstacle) for obstacle in obstacles)
+        self.target_list: Tuple[Tuple[int, int], ...] = tuple(tuple(target) for target in targets)
+        self.targets: FrozenSet[Tuple[int, int]] = frozenset(self.target_list)
+
+        self.coords: Tuple[Tuple[int, int], ...] = tuple((x, y) for x in range(length) for y in range(width))
+        self.wall_cells: FrozenSet[int] = frozenset(self.index(x, y) for x, y in self.walls)
+        self.target_cells: FrozenSet[int] = frozenset(self.index(x, y) for x, y in self.targets)
+        self.target_cell_list: Tuple[int, ...] = tuple(self.index(x, y) for x, y in self.target_list)
+        self.is_wall: List[bool] = [cell in self.wall_cells for cell in range(self.size)]
+        self.is_target: List[bool] = [cell in self.target_cells for cell in range(self.size)]
+
+        self.neighbours: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(
+                self.index(nx, ny)
+                for nx, ny in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1))
+                if self.in_bounds(nx, ny) and (nx, ny) not in self.walls
+            )
+            for x, y in self.coords
+        )
+
+        # Indexed by LEFT..DOWN, so that move_table[move][cell] needs no offset arithmetic
+        self.move_table: List[Optional[List[int]]] = [None] * (DOWN + 1)
+        for move, (dx, dy) in MOVE_OFFSETS.items():
+            self.move_table[move] = [
+                self.index(x + dx, y + dy)
+                if self.in_bounds(x + dx, y + dy) and (x + dx, y + dy) not in self.walls else -1
+                for x, y in self.coords
+            ]
+
+        self.reachable_cells: FrozenSet[Tuple[int, int]] = self.compute_reachable_cells()
+        self.dead_squares: FrozenSet[Tuple[int, int]] = self.compute_dead_squares()
+        self.dead_cells: FrozenSet[int] = frozenset(self.index(x, y) for x, y in self.dead_squares)
+        self.target_distances: List[Optional[int]] = self.compute_target_distances()
+
+        # Distance tables of every cell to every target, so heuristics answer distance queries with a lookup
+        self.box_distances: List[List[float]] = [self.compute_box_distances(target) for target in self.target_cell_list]
+        self.nearest_box_distance: List[float] = [
+            min((distances[cell] for distances in self.box_distances), default=inf) for cell in range(self.size)
+        ]
+        self.manhattan_distances: List[List[int]] = [
+            [abs(x - tx) + abs(y - ty) for x, y in self.coords] for tx, ty in self.target_list
+        ]
+        self.nearest_manhattan: List[float] = [
+            min((distances[cell] for distances in self.manhattan_distances), default=inf) for cell in range(self.size)
+        ]
+        self.manhattan_rows: List[Optional[array]] = [None] * self.size
+
+        generator = random.Random(ZOBRIST_SEED)
+        self.zobrist_player: List[int] = [generator.getrandbits(64) for _ in range(self.size)]
+        self.zobrist_boxes: List[int] = [generator.getrandbits(64) for _ in range(self.size)]
+
+    def index(self, x: int, y: int) -> int:
+        ''' Returns the flat index of a position'''
+        return x * self.width + y
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        ''' Checks if the position is inside the map'''
+        return 0 <= x < self.length and 0 <= y < self.width
+
+    def manhattan_row(self, cell: int) -> array:
+        ''' Returns the Manhattan distances from the cell to every cell, computing them on first use'''
+        row = self.manhattan_rows[cell]
+        if row is None:
+            x, y = self.coords[cell]
+            row = array('H', [abs(x - cx) + abs(y - cy) for cx, cy in self.coords])
+            self.manhattan_rows[cell] = row
+        return row
+
+    def zobrist_key(self, player: int, boxes: Iterable[int]) -> int:
+        ''' Computes the Zobrist key of a position from scratch, moves then update it with two XORs per object'''
+        key = self.zobrist_player[player]
+        for box in boxes:
+            key ^= self.zobrist_boxes[box]
+        return key
+
+    def compute_reachable_cells(self) -> FrozenSet[Tuple[int, int]]:
+        ''' Pulls boxes backwards from every target to find the positions a box can be pushed from'''
+        floor = {
+            (x, y) for x in range(self.length)
+                for y in range(self.width)
+                if (x, y) not in self.walls
+        }
+        reach = set(self.targets)
+        q = deque(self.target_list)
+        while q:
+            tx, ty = q.popleft()
+            for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                bx, by = tx - dx, ty - dy
+                px, py = tx - 2 * dx, ty - 2 * dy
+                if (bx, by) in floor and (px, py) in floor and (bx, by) not in reach:
+                    reach.add((bx, by))
+                    q.append((bx, by))
+        return frozenset(reach)
+
+    def compute_dead_squares(self) -> FrozenSet[Tuple[int, int]]:
+        """
+        All cells that never made it into `compute_reachable_cells`
+        and aren’t actual targets.
+        """
+        return frozenset(
+            (x, y)
+            for x in range(self.length)
+            for y in range(self.width)
+            if (x, y) not in self.reachable_cells
+            and (x, y) not in self.targets
+        )
+
+    def compute_target_distances(self) -> List[Optional[int]]:
+        ''' BFS from all targets at once, giving each cell its distance to the nearest target'''
+        distances: List[Optional[int]] = [None] * self.size
+        queue = deque()
+
+        for cell in self.target_cells:
+            distances[cell] = 0
+            queue.append(cell)
+
+        while queue:
+            cell = queue.popleft()
+            for neighbour in self.neighbours[cell]:
+                if distances[neighbour] is None:
+                    distances[neighbour] = distances[cell] + 1
+                    queue.append(neighbour)
+
+        return distances
+
+    def compute_box_distances(self, target: int, pulls: bool = True) -> List[float]:
+        '''
+        BFS backwards from the target over box positions, ignoring the other boxes.
+        Gives the number of box moves needed to bring a box from every cell to the target, inf if it never can.
+
+        A box moves one cell when the player can stand behind it and push it,
+        or, since the moves also allow pulls, stand in front of it with room to step back and drag it.
+        '''
+        move_table = self.move_table
+        distances = [inf] * self.size
+        distances[target] = 0
+        queue = deque([target])
+
+        while queue:
+            cell = queue.popleft()
+            for move in (LEFT, RIGHT, UP, DOWN):
+                # The box reached the cell by moving in this direction from the previous cell
+                backwards = move_table[OPPOSITE_MOVES[move]]
+                previous = backwards[cell]
+                if previous < 0 or distances[previous] != inf:
+                    continue
+
+                can_push = backwards[previous] >= 0
+                can_pull = pulls and move_table[move][cell] >= 0
+                if can_push or can_pull:
+                    distances[previous] = distances[cell] + 1
+                    queue.append(previous)
+
+        return distances
@@ -1,10 +1,10 @@
 from .player import Player
+from .board import StaticBoard, OPPOSITE_MOVES
 from .box import Box
 from .moves import *
 
 from matplotlib import pyplot as plt
-from typing import Optional, Set, Tuple
-from collections import deque
+from typing import FrozenSet, Optional, Tuple
 import yaml
 import os
 
@@ -29,8 +29,10 @@ class Map:
     map: 2D matrix representing the map
     explored_states: number of explored states
     undo_moves: number of undo moves made // e.g. _ P B => P B _
+    board: static part of the level, shared by every copy of the map and every search state
+    key: 64-bit Zobrist key of the player and box positions, updated incrementally by apply_move
     '''
-    def __init__(self, length, width, player_x, player_y, boxes, targets, obstacles, test_name='test'):
+    def __init__(self, length, width, player_x, player_y, boxes, targets, obstacles, test_name='test', board=None):
         self.length = length
         self.width = width
         self.map = [[0 for _ in range(width)] for _ in range(length)]
@@ -62,39 +64,22 @@ class Map:
             self.targets.append((target_x, target_y))
             self.map[target_x][target_y] = TARGET_SYMBOL
 
-        self.dead_squares = self.compute_dead_squares()
-
-    def compute_reachable_cells(self)->Set[Tuple[int,int]]:
-        floor = {
-            (x,y) for x in range(self.length)
-                for y in range(self.width)
-                if (x,y) not in self.obstacles
-        }
-        reach = set(self.targets)
-        q = deque(self.targets)
-        while q:
-            tx,ty = q.popleft()
-            for dx,dy in [(-1,0),(1,0),(0,-1),(0,1)]:
-                bx,by = tx-dx, ty-dy
-                px,py = tx-2*dx, ty-2*dy
-                if (bx,by) in floor and (px,py) in floor and (bx,by) not in reach:
-                    reach.add((bx,by))
-                    q.append((bx,by))
-        return reach
-
-    def compute_dead_squares(self) -> Set[Tuple[int,int]]:
-        """
-        All floor‐cells that never made it into `compute_reachable_cells`
-        and aren’t actual targets.
-        """
-        reachables = self.compute_reachable_cells()
-        return {
-            (x, y)
-            for x in range(self.length)
-            for y in range(self.width)
-            if (x, y) not in reachables
-            and (x, y) not in self.targets
-        }
+        # The static board is computed once per level and then shared by reference
+        self.board = board if board is not None else StaticBoard(length, width, obstacles, targets)
+        self.dead_squares = self.board.dead_squares
+
+        self.key = self.board.zobrist_key(
+            self.board.index(player_x, player_y),
+            [self.board.index(box_x, box_y) for box_x, box_y in self.positions_of_boxes]
+        )
+
+    def compute_reachable_cells(self) -> FrozenSet[Tuple[int,int]]:
+        ''' Returns the positions a box can be pushed from to reach some target'''
+        return self.board.reachable_cells
+
+    def compute_dead_squares(self) -> FrozenSet[Tuple[int,int]]:
+        ''' Returns the positions a box can never be pushed to a target from'''
+        return self.board.dead_squares
 
     @classmethod
     def from_str(cls, state_str):
@@ -267,7 +252,9 @@ class Map:
                     box.make_move(move)
                     self.map[box.x][box.y] = BOX_SYMBOL
                     self.positions_of_boxes[(box.x, box.y)] = box.name
+                    self._update_key(self.board.zobrist_boxes, future_position, (box.x, box.y))
 
+                self._update_key(self.board.zobrist_player, (self.player.x, self.player.y), future_position)
                 self.player.make_move(move)
             else:
                 raise ValueError('Apply Error: Got to make an invalid move')
@@ -292,11 +279,14 @@ class Map:
                 # Update the position of the box in the dictionary
                 del self.positions_of_boxes[(box.x, box.y)]
                 self.map[box.x][box.y] = 0
+                box_position = (box.x, box.y)
 
                 box.make_move(implicit_move)
                 self.map[box.x][box.y] = BOX_SYMBOL
                 self.positions_of_boxes[(box.x, box.y)] = box.name
+                self._update_key(self.board.zobrist_boxes, box_position, (box.x, box.y))
 
+                self._update_key(self.board.zobrist_player, (self.player.x, self.player.y), future_position)
                 self.player.make_move(implicit_move)
             else:
                 raise ValueError('Apply Error: Got to make an invalid move')
@@ -310,6 +300,16 @@ class Map:
             if (target_x, target_y) not in self.positions_of_boxes:
                 self.map[target_x][target_y] = TARGET_SYMBOL
 
+    def _update_key(self, table, old_position, new_position):
+        ''' XORs an object out of its old cell and into its new one in the Zobrist key'''
+        board = self.board
+        self.key ^= table[board.index(*old_position)] ^ table[board.index(*new_position)]
+
+    @property
+    def player_position(self) -> Tuple[int, int]:
+        ''' Returns the position of the player as a tuple'''
+        return (self.player.x, self.player.y)
+
     def is_solved(self):
         ''' Checks if all the boxes are on the targets'''
         for target_x, target_y in self.targets:
@@ -320,19 +320,51 @@ class Map:
 
     def filter_possible_moves(self):
         ''' Returns the possible moves the player can make'''
-        possible_moves = []
-        for move in range(LEFT, BOX_DOWN + 1):
-            if self.is_valid_move(move):
-                possible_moves.append(move)
-        return possible_moves
+        # Same rules as is_valid_move, answered with the precomputed move tables of the board
+        board = self.board
+        move_table = board.move_table
+        coords = board.coords
+        boxes = self.positions_of_boxes
+        player = board.index(self.player.x, self.player.y)
+
+        player_moves = []
+        box_moves = []
+        for move in (LEFT, RIGHT, UP, DOWN):
+            future_position = move_table[move][player]
+            if future_position < 0:
+                continue
+
+            if coords[future_position] in boxes:
+                box_future = move_table[move][future_position]
+                if box_future >= 0 and coords[box_future] not in boxes:
+                    player_moves.append(move)
+                    box_moves.append(move + 4)
+            else:
+                player_moves.append(move)
+                opposite_position = move_table[OPPOSITE_MOVES[move]][player]
+                if opposite_position >= 0 and coords[opposite_position] in boxes:
+                    box_moves.append(move + 4)
+
+        return player_moves + box_moves
 
     def copy(self):
         ''' Returns a copy of the current state'''
-        new_map = Map(self.length, self.width, self.player.x, self.player.y, [(box.name, box.x, box.y) for box in self.boxes.values()], self.targets, self.obstacles)
+        # The static board (obstacles, targets, dead squares) is shared, not rebuilt
+        new_map = Map.__new__(Map)
+        new_map.length = self.length
+        new_map.width = self.width
+        new_map.obstacles = self.obstacles
+        new_map.targets = self.targets
+        new_map.dead_squares = self.dead_squares
+        new_map.board = self.board
+        new_map.test_name = self.test_name
         new_map.map = [row.copy() for row in self.map]
+        new_map.player = Player(self.player.name, self.player.symbol, self.player.x, self.player.y)
+        new_map.boxes = {name: Box(name, box.symbol, box.x, box.y) for name, box in self.boxes.items()}
         new_map.positions_of_boxes = self.positions_of_boxes.copy()
         new_map.explored_states = self.explored_states
         new_map.undo_moves = self.undo_moves
+        new_map.key = self.key
         return new_map
 
     def get_neighbours(self):
@@ -0,0 +1,306 @@
+from .map import Map
+from .board import StaticBoard, OPPOSITE_MOVES
+from .moves import *
+
+from collections import deque
+from typing import FrozenSet, List, Optional, Set, Tuple
+
+
+__all__ = ['State']
+
+
+class State:
+    '''
+    State Class records only the part of the board that changes during a search:
+    where the player is and where the boxes are.
+    Everything static (size, obstacles, targets, dead squares) lives on the shared board,
+    so a state is cheap to copy and can be hashed.
+
+    Positions are flat cell indices of the board: cell = x * width + y
+
+    Attributes:
+    board: static board of the level, shared by reference
+    player: cell of the player
+    boxes: frozenset of the cells of the boxes
+    undo_moves: number of undo moves made // e.g. _ P B => P B _
+    key: 64-bit Zobrist key of the player and box positions, updated incrementally by every move
+    box_mask: the box cells as a bitset (bit cell set for a box on cell), for bitwise deadlock checks
+    moved_box: cell the last move brought a box to, -1 if it moved no box, None when unknown (e.g. the root state)
+    '''
+    __slots__ = ('board', 'player', 'boxes', 'undo_moves', 'key', 'box_mask', 'moved_box')
+
+    def __init__(self, board: StaticBoard, player: int, boxes: FrozenSet[int], undo_moves: int = 0,
+                 key: Optional[int] = None, box_mask: Optional[int] = None, moved_box: Optional[int] = None):
+        self.board = board
+        self.player = player
+        self.boxes = boxes
+        self.undo_moves = undo_moves
+        self.key = key if key is not None else board.zobrist_key(player, boxes)
+        self.box_mask = box_mask if box_mask is not None else sum(1 << box for box in boxes)
+        self.moved_box = moved_box
+
+    @classmethod
+    def from_map(cls, map: Map) -> 'State':
+        ''' Builds the search state of a map'''
+        board = map.board
+        boxes = frozenset(board.index(x, y) for x, y in map.positions_of_boxes)
+        return cls(board, board.index(map.player.x, map.player.y), boxes, map.undo_moves)
+
+    def to_map(self, test_name: str = 'test') -> Map:
+        ''' Builds a full map from the state, used for rendering and YAML export'''
+        board = self.board
+        coords = board.coords
+        player_x, player_y = coords[self.player]
+        boxes = [(f'box{i}', *coords[cell]) for i, cell in enumerate(sorted(self.boxes))]
+        new_map = Map(board.length, board.width, player_x, player_y, boxes,
+                      list(board.target_list), sorted(board.walls), test_name, board=board)
+        new_map.undo_moves = self.undo_moves
+        return new_map
+
+    @property
+    def positions_of_boxes(self) -> List[Tuple[int, int]]:
+        ''' Returns the (x, y) positions of the boxes'''
+        coords = self.board.coords
+        return [coords[cell] for cell in self.boxes]
+
+    @property
+    def player_position(self) -> Tuple[int, int]:
+        ''' Returns the (x, y) position of the player'''
+        return self.board.coords[self.player]
+
+    @property
+    def box_key(self) -> int:
+        ''' Zobrist key of the box positions alone, shared by every player position'''
+        return self.key ^ self.board.zobrist_player[self.player]
+
+    def is_valid_move(self, move: int) -> bool:
+        ''' Checks if the move is valid, following the same rules as Map.is_valid_move'''
+        if move < LEFT or move > BOX_DOWN:
+            raise ValueError('is_valid_move outside range error')
+
+        direction = move - 4 if move >= BOX_LEFT else move
+        move_table = self.board.move_table
+        future_position = move_table[direction][self.player]
+
+        if future_position < 0:
+            return False
+
+        # Walking into a box pushes it, so the box has to be able to move as well
+        if future_position in self.boxes:
+            box_future = move_table[direction][future_position]
+            return box_future >= 0 and box_future not in self.boxes
+
+        if move < BOX_LEFT:
+            return True
+
+        # Box moves without a box in front are pulls of the box behind the player
+        return move_table[OPPOSITE_MOVES[direction]][self.player] in self.boxes
+
+    def filter_possible_moves(self) -> List[int]:
+        ''' Returns the possible moves the player can make, in the same order as Map.filter_possible_moves'''
+        move_table = self.board.move_table
+        boxes = self.boxes
+        player = self.player
+
+        player_moves = []
+        box_moves = []
+        for direction in (LEFT, RIGHT, UP, DOWN):
+            future_position = move_table[direction][player]
+            if future_position < 0:
+                continue
+
+            if future_position in boxes:
+                box_future = move_table[direction][future_position]
+                if box_future >= 0 and box_future not in boxes:
+                    player_moves.append(direction)
+                    box_moves.append(direction + 4)
+            else:
+                player_moves.append(direction)
+                if move_table[OPPOSITE_MOVES[direction]][player] in boxes:
+                    box_moves.append(direction + 4)
+
+        return player_moves + box_moves
+
+    def apply_move(self, move: int) -> 'State':
+        ''' Returns the state reached by applying the move, the current state is left untouched'''
+        new_state = self.copy()
+        new_state.make_move(move)
+        return new_state
+
+    def make_move(self, move: int) -> Tuple[int, FrozenSet[int], int, int, int, Optional[int]]:
+        '''
+        Applies the move in place and returns the undo record that undo_move needs to restore the state.
+        Used by depth-first searches, which keep a single state and backtrack instead of copying it.
+        '''
+        if move < LEFT or move > BOX_DOWN:
+            raise ValueError('Apply Error: Got to make an invalid move')
+
+        board = self.board
+        direction = move - 4 if move >= BOX_LEFT else move
+        move_table = board.move_table
+        future_position = move_table[direction][self.player]
+        if future_position < 0:
+            raise ValueError('Apply Error: Got to make an invalid move')
+
+        undo_record = (self.player, self.boxes, self.undo_moves, self.key, self.box_mask, self.moved_box)
+        zobrist_boxes = board.zobrist_boxes
+        moved_box = -1
+
+        if future_position in self.boxes:
+            box_future = move_table[direction][future_position]
+            if box_future < 0 or box_future in self.boxes:
+                raise ValueError('Apply Error: Got to make an invalid move')
+            self.boxes = self.boxes - {future_position} | {box_future}
+            self.key ^= zobrist_boxes[future_position] ^ zobrist_boxes[box_future]
+            self.box_mask ^= (1 << future_position) | (1 << box_future)
+            moved_box = box_future
+        elif move >= BOX_LEFT:
+            box_position = move_table[OPPOSITE_MOVES[direction]][self.player]
+            if box_position not in self.boxes:
+                raise ValueError('Apply Error: Got to make an invalid move')
+            self.boxes = self.boxes - {box_position} | {self.player}
+            self.key ^= zobrist_boxes[box_position] ^ zobrist_boxes[self.player]
+            self.box_mask ^= (1 << box_position) | (1 << self.player)
+            moved_box = self.player
+            self.undo_moves += 1
+
+        # XOR out the old cell of the player and XOR in the new one
+        self.key ^= board.zobrist_player[self.player] ^ board.zobrist_player[future_position]
+        self.player = future_position
+        self.moved_box = moved_box
+        return undo_record
+
+    def undo_move(self, undo_record: Tuple[int, FrozenSet[int], int, int, int, Optional[int]]) -> None:
+        ''' Restores the state saved by make_move'''
+        self.player, self.boxes, self.undo_moves, self.key, self.box_mask, self.moved_box = undo_record
+
+    def make_box_move(self, cell: int, move: int) -> Tuple[int, FrozenSet[int], int, int, int, Optional[int]]:
+        '''
+        Walks the player to the cell and applies the box move from there, in place.
+        Returns the undo record that undo_move needs to restore the state, walk included.
+        '''
+        undo_record = (self.player, self.boxes, self.undo_moves, self.key, self.box_mask, self.moved_box)
+
+        zobrist_player = self.board.zobrist_player
+        self.key ^= zobrist_player[self.player] ^ zobrist_player[cell]
+        self.player = cell
+
+        try:
+            self.make_move(move)
+        except ValueError:
+            self.undo_move(undo_record)
+            raise
+
+        return undo_record
+
+    def reachable_cells(self) -> Set[int]:
+        ''' Flood fills the cells the player can walk to without moving any box'''
+        boxes = self.boxes
+        neighbours = self.board.neighbours
+        reachable = {self.player}
+        stack = [self.player]
+        while stack:
+            cell = stack.pop()
+            for neighbour in neighbours[cell]:
+                if neighbour not in reachable and neighbour not in boxes:
+                    reachable.add(neighbour)
+                    stack.append(neighbour)
+        return reachable
+
+    def canonical_key(self, reachable: Optional[Set[int]] = None) -> int:
+        '''
+        Zobrist key of the state with the player moved to the smallest cell it can walk to,
+        so states that only differ by a walk of the player share the same key
+        '''
+        if reachable is None:
+            reachable = self.reachable_cells()
+        zobrist_player = self.board.zobrist_player
+        return self.key ^ zobrist_player[self.player] ^ zobrist_player[min(reachable)]
+
+    def box_moves(self, reachable: Optional[Set[int]] = None) -> List[Tuple[int, int]]:
+        '''
+        Returns the pushes and pulls the player can make after walking inside its reachable region,
+        as (cell to walk to, box move) pairs
+        '''
+        if reachable is None:
+            reachable = self.reachable_cells()
+
+        boxes = self.boxes
+        move_table = self.board.move_table
+        box_moves = []
+        for box in sorted(boxes):
+            for move in (LEFT, RIGHT, UP, DOWN):
+                step = move_table[move]
+                front = step[box]
+                if front < 0 or front in boxes:
+                    continue
+
+                # Push: the player stands behind the box and the box goes one cell further
+                behind = move_table[OPPOSITE_MOVES[move]][box]
+                if behind in reachable:
+                    box_moves.append((behind, move + 4))
+
+                # Pull: the player stands in front of the box and steps away, dragging the box
+                if front in reachable:
+                    player_future = step[front]
+                    if player_future >= 0 and player_future not in boxes:
+                        box_moves.append((front, move + 4))
+
+        return box_moves
+
+    def walk_to(self, cell: int) -> List[int]:
+        ''' Returns the moves of a shortest walk of the player to the cell, without moving any box'''
+        parents = {self.player: None}
+        queue = deque([self.player])
+        while queue and cell not in parents:
+            current = queue.popleft()
+            for move in (LEFT, RIGHT, UP, DOWN):
+                neighbour = self.board.move_table[move][current]
+                if neighbour >= 0 and neighbour not in parents and neighbour not in self.boxes:
+                    parents[neighbour] = (current, move)
+                    queue.append(neighbour)
+
+        if cell not in parents:
+            raise ValueError('Walk Error: the player can not reach the cell')
+
+        moves = []
+        while parents[cell] is not None:
+            cell, move = parents[cell]
+            moves.append(move)
+        moves.reverse()
+        return moves
+
+    def expand_box_moves(self, box_moves: List[Tuple[int, int]]) -> List[int]:
+        ''' Turns (cell to walk to, box move) pairs, starting from this state, back into the full list of moves'''
+        state = self.copy()
+        moves = []
+        for cell, move in box_moves:
+            moves.extend(state.walk_to(cell))
+            state.make_box_move(cell, move)
+            moves.append(move)
+        return moves
+
+    def get_neighbours(self) -> List['State']:
+        ''' Returns the neighbours of the current state'''
+        return [self.apply_move(move) for move in self.filter_possible_moves()]
+
+    def is_solved(self) -> bool:
+        ''' Checks if all the boxes are on the targets'''
+        return self.boxes.issuperset(self.board.target_cells)
+
+    def copy(self) -> 'State':
+        ''' Returns a copy of the current state'''
+        return State(self.board, self.player, self.boxes, self.undo_moves, self.key, self.box_mask, self.moved_box)
+
+    def __eq__(self, other):
+        return isinstance(other, State) and self.player == other.player and self.boxes == other.boxes
+
+    def __hash__(self):
+        return self.key
+
+    def __lt__(self, other):
+        return (self.player, sorted(self.boxes)) < (other.player, sorted(other.boxes))
+
+    def __str__(self):
+        ''' Overriding toString method for State class'''
+        return str(self.to_map())
@@ -0,0 +1,49 @@
+from search_methods.heuristics import manhattan_greedy_safe
+from search_methods.ida_star import IDAStarSolver
+from search_methods.parallel_ida_star import ParallelIDAStarSolver
+from search_methods.solver import SOLVED, UNSOLVABLE
+from sokoban.map import Map
+
+import pytest
+
+def walled_off_map() -> Map:
+    """A box and its target on both sides of a wall across the level, with no deadlock rule to notice it"""
+    return Map(3, 5, 0, 0, [('box1', 1, 1)], [(1, 3)], [(0, 2), (1, 2), (2, 2)], 'walled_off')
+
+@pytest.mark.parametrize('push_level', [False, True])
+def test_unsolvable_level_ends_without_a_budget(push_level):
+    result = IDAStarSolver(walled_off_map(), manhattan_greedy_safe, [], push_level=push_level).run()
+    assert result.status == UNSOLVABLE
+
+@pytest.mark.parametrize('push_level', [False, True])
+def test_solution_replays_to_the_goal(push_level):
+    level = Map.from_yaml('tests/easy_map1.yaml')
+    result = IDAStarSolver(level, manhattan_greedy_safe, ['corner'], push_level=push_level).run()
+    assert result.status == SOLVED
+    for move in result.moves:
+        level.apply_move(move)
+    assert level.is_solved()
+
+@pytest.mark.parametrize('push_level', [False, True])
+def test_learned_deadlock_is_loaded_and_hit_by_the_next_run(tmp_path, push_level):
+    path = str(tmp_path / 'deadlocks.json')
+    first = IDAStarSolver(walled_off_map(), manhattan_greedy_safe, [], push_level=push_level, deadlock_db=path)
+    assert first.run().status == UNSOLVABLE
+    assert len(first.deadlock_db) > 0
+
+    second = IDAStarSolver(walled_off_map(), manhattan_greedy_safe, [], push_level=push_level, deadlock_db=path)
+    assert second.deadlock_db.loaded > 0
+    assert second.run().status == UNSOLVABLE
+    assert second.deadlock_db.hits > 0
+
+def test_parallel_solve_saves_and_uses_the_learned_deadlocks(tmp_path):
+    path = str(tmp_path / 'deadlocks.json')
+    first = ParallelIDAStarSolver(walled_off_map(), manhattan_greedy_safe, [], workers=2, deadlock_db=path)
+    first.solve()
+    assert first.result.status == UNSOLVABLE
+
+    second = ParallelIDAStarSolver(walled_off_map(), manhattan_greedy_safe, [], workers=2, deadlock_db=path)
+    second.solve()
+    assert second.deadlock_db.loaded > 0
+    assert second.result.status == UNSOLVABLE
+    assert second.deadlock_db.hits > 0
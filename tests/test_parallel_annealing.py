@@ -0,0 +1,19 @@
+from search_methods.heuristics import manhattan_greedy_safe
+from search_methods.parallel_annealing import ParallelAnnealingSolver
+from search_methods.solver import TIMEOUT
+from sokoban.map import Map
+
+import os
+
+def walled_off_map() -> Map:
+    """A box and its target on both sides of a wall across the level, so no chain ever solves it"""
+    return Map(3, 5, 0, 0, [('box1', 1, 1)], [(1, 3)], [(0, 2), (1, 2), (2, 2)], 'walled_off')
+
+def test_deadline_covers_chains_waiting_for_a_process():
+    deadline = 0.5
+    solver = ParallelAnnealingSolver(walled_off_map(), manhattan_greedy_safe, [], chains=3 * os.cpu_count(), seed=1,
+                                     decay_rate=1e-12, min_temp=1e-9, patience=None, deadline=deadline)
+    result = solver.run()
+    assert result.status == TIMEOUT
+    # Chains run in turns on each process, with a deadline each they would take three times as long
+    assert result.elapsed < 2 * deadline